@@ -0,0 +1,275 @@
+"""
+Throughput and latency of the update pipeline, run offline: synthetic updates go through
+a real TelegramBot dispatcher and every Bot API call is answered by an in-process fake.
+
+    python benchmarks/dispatch.py
+    python benchmarks/dispatch.py --updates 20000 --handlers 50 --phrases 20 --faq-size 2000 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from telegram import Update  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+from engine import TelegramBot  # noqa: E402
+from engine.core.context_store import FileContextStore  # noqa: E402
+from engine.core.content import Keyboard  # noqa: E402
+from engine.core.metrics import Metrics  # noqa: E402
+from engine.faq_models.vectorizer import Vectorizer  # noqa: E402
+
+WORDS = [
+    "price", "order", "delivery", "refund", "card", "account", "password", "schedule", "address",
+    "support", "bonus", "discount", "return", "size", "color", "payment", "status", "contact",
+]
+
+
+class FakeBotApi(Request):
+    """Answers Bot API calls in process, optionally after `latency` seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(con_pool_size=1)
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.message_id = 0
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit("/", 1)[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.message_id += 1
+            message_id = self.message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id", 1)), "type": "private"},
+        }
+        if method == "sendMediaGroup":
+            return [message for _ in data["media"]]
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": "u", "width": 1, "height": 1}]
+        return message
+
+
+class HashingEncoder:
+    """Bag of hashed words, a stand-in for the sentence model"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def encode(self, sentences, **kwargs):
+        vectors = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        return vectors
+
+
+def synthetic_faq(size: int, rng: random.Random):
+    return {
+        f"intent_{i}": {
+            "phrases": [" ".join(rng.sample(WORDS, 3)) + f" q{i}" for _ in range(3)],
+            "answer": f"answer {i}",
+            "metadata": {},
+        }
+        for i in range(size)
+    }
+
+
+def handler_phrases(handler: int, phrases: int):
+    # every fifth phrase is a regular expression
+    return [
+        fr"order{handler}_{j} \d+" if j % 5 == 4 else f"command{handler}_{j}"
+        for j in range(phrases)
+    ]
+
+
+def synthetic_updates(args, faq_dict, rng: random.Random):
+    faq_phrases = [phrase for intent in faq_dict.values() for phrase in intent["phrases"]]
+    updates = []
+    for update_id in range(args.updates):
+        user = {"id": rng.randrange(1, args.users + 1), "is_bot": False, "first_name": "user"}
+        chat = {"id": user["id"], "type": "private"}
+        kind = rng.random()
+        if kind < args.callback_share:
+            updates.append({"update_id": update_id, "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(user["id"]),
+                "from": user,
+                "data": f"menu {rng.randrange(10)}",
+                "message": {"message_id": update_id, "date": 0, "chat": chat, "text": "menu"},
+            }})
+            continue
+        message = {"message_id": update_id, "date": 0, "chat": chat, "from": user}
+        if kind < args.callback_share + args.media_share:
+            message["photo"] = [{"file_id": f"photo{update_id}", "file_unique_id": "u", "width": 1, "height": 1}]
+            message["caption"] = "photo"
+        else:
+            handler = rng.randrange(args.handlers)
+            phrase = rng.randrange(args.phrases)
+            message["text"] = rng.choice([
+                f"command{handler}_{phrase}",
+                f"order{handler}_{phrase} {rng.randrange(1000)}",
+                rng.choice(faq_phrases) if faq_phrases else "hello",
+                " ".join(rng.sample(WORDS, 4)),
+            ])
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+def build_bot(args, faq_path):
+    bot = TelegramBot(
+        token="123456:benchmark",
+        use_context=True,
+        bot_name="dispatch_benchmark",
+        context_store=FileContextStore("contexts"),
+        update_workers=args.update_workers,
+    )
+    bot.bot._request = FakeBotApi(args.api_latency)
+    menu = Keyboard([[f"menu {i}" for i in range(5)], [f"menu {i}" for i in range(5, 10)]], inline_mode=True)
+
+    for handler in range(args.handlers):
+        @bot.bot_handler(phrases=handler_phrases(handler, args.phrases), priority=2)
+        def command(update, context):
+            bot.response_processing(context["id"], "command", keyboard=menu)
+
+    @bot.bot_handler(phrases=["menu"], inline_mode=True, priority=3)
+    def inline(update, context):
+        bot.response_processing(context["id"], update["callback_query"]["data"])
+
+    @bot.bot_handler(file_types=["photo"], priority=1)
+    def photo(update, context):
+        bot.response_processing(context["id"], "photo received")
+
+    if faq_path is not None:
+        @bot.bot_handler(faq_json_path=faq_path, similarity_score=0.5)
+        def faq(update, context):
+            bot.response_processing(context["id"], update["handler_payload"]["faq_answer"][0][1]["answer"])
+
+    bot.add_handlers()
+    return bot
+
+
+def run(bot, updates, workers: int, in_flight: int):
+    latencies = []
+    handling = []
+    lock = threading.Lock()
+    position = iter(updates)
+    started = {}
+    # feeders wait while `in_flight` updates are unhandled, otherwise latency would be
+    # mostly the wait in the queues of the update workers
+    window = threading.BoundedSemaphore(in_flight)
+
+    # with update workers process_update only queues the update, so latency is taken when it is handled
+    run_update = bot.run_update
+
+    def timed_run_update(update):
+        start = time.perf_counter()
+        try:
+            run_update(update)
+        finally:
+            end = time.perf_counter()
+            window.release()
+        with lock:
+            latencies.append(end - started.pop(update.update_id))
+            handling.append(end - start)
+
+    bot.run_update = timed_run_update
+
+    def work():
+        while True:
+            with lock:
+                data = next(position, None)
+            if data is None:
+                break
+            update = Update.de_json(data, bot.bot)
+            window.acquire()
+            started[update.update_id] = time.perf_counter()
+            bot.dispatcher.process_update(update)
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if bot.update_executor is not None:
+        bot.update_executor.join()
+    bot.run_update = run_update
+    return time.perf_counter() - start, sorted(latencies), sorted(handling)
+
+
+def percentile(values, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--handlers", type=int, default=20)
+    parser.add_argument("--phrases", type=int, default=10, help="phrases per handler")
+    parser.add_argument("--faq-size", type=int, default=500, help="FAQ intents, 0 for no FAQ handler")
+    parser.add_argument("--workers", type=int, default=1, help="threads feeding the dispatcher")
+    parser.add_argument("--update-workers", type=int, default=1, help="TelegramBot update_workers")
+    parser.add_argument("--in-flight", type=int, default=None,
+                        help="updates submitted but not handled yet, 2 per update worker by default")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--callback-share", type=float, default=0.2)
+    parser.add_argument("--media-share", type=float, default=0.1)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.in_flight is None:
+        args.in_flight = 2 * max(args.update_workers, args.workers)
+    rng = random.Random(args.seed)
+    faq_dict = synthetic_faq(args.faq_size, rng)
+    Vectorizer.model = HashingEncoder()
+    Vectorizer.model_name = "benchmark-hashing"
+
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        faq_path = None
+        if args.faq_size:
+            faq_path = str(Path(cwd) / "faq.json")
+            with open(faq_path, "w", encoding="utf-8") as file:
+                json.dump(faq_dict, file)
+        bot = build_bot(args, faq_path)
+        updates = synthetic_updates(args, faq_dict, rng)
+
+        run(bot, updates[:args.warmup], args.workers, args.in_flight)
+        Metrics.reset()
+        elapsed, latencies, handling = run(bot, updates[args.warmup:], args.workers, args.in_flight)
+        bot.stop()
+
+    print(f"updates: {len(latencies)}, handlers: {args.handlers + 2 + bool(faq_path)}, "
+          f"phrases per handler: {args.phrases}, FAQ intents: {args.faq_size}, "
+          f"workers: {args.workers}, update workers: {args.update_workers}, in flight: {args.in_flight}")
+    print(f"throughput: {len(latencies) / elapsed:.0f} updates/s")
+    print(f"latency: p50 {percentile(latencies, 0.5) * 1000:.3f} ms, p99 {percentile(latencies, 0.99) * 1000:.3f} ms")
+    print(f"handling: p50 {percentile(handling, 0.5) * 1000:.3f} ms, p99 {percentile(handling, 0.99) * 1000:.3f} ms, "
+          f"the rest of the latency is queue wait")
+    print(f"Bot API calls: {json.dumps(bot.bot._request.calls, sort_keys=True)}")
+    print(f"FAQ result cache: {json.dumps(bot.faq_cache.stats())}")
+    print(f"\n{'stage':<24}{'count':>10}{'mean, ms':>12}")
+    for stage, values in sorted(Metrics.snapshot()["stages"].items(), key=lambda item: -item[1]["sum"]):
+        print(f"{stage:<24}{values['count']:>10}{values['mean'] * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
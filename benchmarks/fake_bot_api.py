@@ -0,0 +1,142 @@
+"""
+Local HTTP stand-in for the Bot API, and a benchmark of outbound sends through it.
+Each call is answered after `--latency` seconds, like a round trip to Telegram.
+
+    python benchmarks/fake_bot_api.py --chats 50 --messages 20 --latency 0.05 --send-workers 0 8 32
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from engine import TelegramBot  # noqa: E402
+from engine.core.context_store import FileContextStore  # noqa: E402
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    """
+    Answers `POST /bot<token>/<method>` with a message, `calls` keeps the order
+    in which the calls to every chat arrived
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, List[dict]] = {}
+        self.lock = threading.Lock()
+        self.message_id = 0
+        super().__init__(("127.0.0.1", port), FakeBotApiRequestHandler)
+        threading.Thread(target=self.serve_forever, name="FakeBotApi", daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/bot"
+
+    def answer(self, method: str, data: dict):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.message_id += 1
+            self.calls.setdefault(str(data.get("chat_id")), []).append(dict(data, method=method))
+            message_id = self.message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+            "text": data.get("text", ""),
+        }
+        if method == "sendMediaGroup":
+            media = json.loads(data["media"]) if isinstance(data["media"], str) else data["media"]
+            return [message for _ in media]
+        return message
+
+
+class FakeBotApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            data = json.loads(body or b"{}")
+        elif content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            data = {
+                part.get_param("name", header="content-disposition"): part.get_content()
+                for part in message.iter_parts()
+                if not part.get_filename()
+            }
+        else:
+            data = dict(urllib.parse.parse_qsl(body.decode()))
+        payload = json.dumps({"ok": True, "result": self.server.answer(method, data)}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(server: FakeBotApiServer, send_workers: int, chats: int, messages: int):
+    server.calls = {}
+    bot = TelegramBot(
+        token="123456:benchmark",
+        use_context=True,
+        bot_name="send_benchmark",
+        context_store=FileContextStore("/tmp/send_benchmark/contexts"),
+        send_workers=send_workers,
+        base_url=server.base_url,
+    )
+    start = time.perf_counter()
+    # one handler thread replies to every chat in turn
+    for number in range(messages):
+        for chat in range(1, chats + 1):
+            bot.response_processing(chat, str(number))
+    handler_time = time.perf_counter() - start
+    if bot.send_queue is not None:
+        bot.send_queue.join()
+    elapsed = time.perf_counter() - start
+    bot.stop()
+    ordered = all(
+        [int(call["text"]) for call in calls] == list(range(messages))
+        for calls in server.calls.values()
+    )
+    return handler_time, elapsed, ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10, help="messages per chat")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--send-workers", type=int, nargs="+", default=[0, 8, 32])
+    args = parser.parse_args()
+
+    server = FakeBotApiServer(latency=args.latency)
+    total = args.chats * args.messages
+    print(f"{'send workers':<14}{'handler, s':>12}{'delivered, s':>14}{'messages/s':>12}  per-chat order")
+    for send_workers in args.send_workers:
+        handler_time, elapsed, ordered = run(server, send_workers, args.chats, args.messages)
+        print(f"{send_workers:<14}{handler_time:>12.3f}{elapsed:>14.3f}{total / elapsed:>12.0f}  {ordered}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Recall and latency of FAQ search backends against the scores of every intent.
+
+    python benchmarks/faq_search.py --phrases 50000 --n-lists 64 128 256 --n-probe 4 8 16
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from engine.faq_models.index import FaqIndex, normalize  # noqa: E402
+from engine.faq_models.search import ExactSearch, IvfSearch, HnswSearch  # noqa: E402
+
+
+def synthetic_faq(phrases: int, phrases_per_intent: int, dim: int, topics: int, rng):
+    """Phrases of one intent lie around a shared point, intents are grouped into topics"""
+    topic_centers = rng.normal(size=(topics, dim))
+    intents = phrases // phrases_per_intent
+    intent_centers = topic_centers[rng.integers(topics, size=intents)] + 0.5 * rng.normal(size=(intents, dim))
+    vectors = np.repeat(intent_centers, phrases_per_intent, axis=0)
+    vectors += 0.3 * rng.normal(size=vectors.shape)
+    faq_dict = {
+        f"intent_{i}": {
+            "phrases": [f"phrase_{i}_{j}" for j in range(phrases_per_intent)],
+            "answer": "",
+            "metadata": {},
+        }
+        for i in range(intents)
+    }
+    return faq_dict, normalize(vectors)
+
+
+def measure(index: FaqIndex, queries: np.ndarray, k: int, reference=None):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(index.top_k(query[None, :], k)[0])
+    elapsed = (time.perf_counter() - start) / len(queries) * 1000
+    if reference is None:
+        return results, elapsed, 1.0
+    recall = np.mean([
+        len(set(result) & set(expected)) / len(expected)
+        for result, expected in zip(results, reference)
+    ])
+    return results, elapsed, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--phrases", type=int, default=20000)
+    parser.add_argument("--phrases-per-intent", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, nargs="+", default=[None])
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    faq_dict, matrix = synthetic_faq(args.phrases, args.phrases_per_intent, args.dim, args.topics, rng)
+    queries = normalize(matrix[rng.integers(len(matrix), size=args.queries)]
+                        + 0.3 * rng.normal(size=(args.queries, args.dim)))
+
+    print(f"{len(matrix)} phrases, {len(faq_dict)} intents, {args.queries} queries, top {args.k}")
+    print(f"{'backend':<32}{'build, s':>10}{'query, ms':>12}{'recall':>10}")
+
+    # the reference ranks intents by the scores of all their phrases, without a backend
+    start = time.perf_counter()
+    scores = FaqIndex(faq_dict, matrix)
+    build = time.perf_counter() - start
+    reference, elapsed, recall = measure(scores, queries, args.k)
+    print(f"{'no backend':<32}{build:>10.2f}{elapsed:>12.3f}{recall:>10.3f}")
+
+    start = time.perf_counter()
+    exact = FaqIndex(faq_dict, matrix, ExactSearch())
+    build = time.perf_counter() - start
+    _, elapsed, recall = measure(exact, queries, args.k, reference)
+    print(f"{'exact':<32}{build:>10.2f}{elapsed:>12.3f}{recall:>10.3f}")
+
+    for n_lists in args.n_lists:
+        start = time.perf_counter()
+        ivf = IvfSearch(n_lists=n_lists, seed=args.seed)
+        index = FaqIndex(faq_dict, matrix, ivf)
+        build = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            _, elapsed, recall = measure(index, queries, args.k, reference)
+            name = f"ivf n_lists={len(ivf.centroids)} n_probe={n_probe}"
+            print(f"{name:<32}{build:>10.2f}{elapsed:>12.3f}{recall:>10.3f}")
+
+    try:
+        import hnswlib  # noqa: F401
+    except ImportError:
+        print("hnswlib is not installed, hnsw backend skipped")
+        return
+    start = time.perf_counter()
+    hnsw = HnswSearch()
+    index = FaqIndex(faq_dict, matrix, hnsw)
+    build = time.perf_counter() - start
+    for ef in args.hnsw_ef:
+        hnsw.graph.set_ef(ef)
+        _, elapsed, recall = measure(index, queries, args.k, reference)
+        print(f"{f'hnsw ef={ef}':<32}{build:>10.2f}{elapsed:>12.3f}{recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
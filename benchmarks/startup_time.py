@@ -0,0 +1,83 @@
+"""
+Startup time and peak memory of a bot, each scenario measured in a fresh interpreter.
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --faq path/to/faq.json
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+SETUP = """
+import sys
+sys.path.insert(0, {root!r})
+{preload}
+from engine import TelegramBot
+
+bot = TelegramBot(token="123456:benchmark", use_context=True, bot_name="startup_benchmark")
+
+@bot.bot_handler(phrases=["start"])
+def start(update, context):
+    pass
+{faq_handler}
+bot.add_handlers()
+heavy = [name for name in ("numpy", "sklearn", "torch", "sentence_transformers") if name in sys.modules]
+print(",".join(heavy) or "-")
+"""
+
+FAQ_HANDLER = """
+@bot.bot_handler(faq_json_path={faq!r})
+def faq(update, context):
+    pass
+"""
+
+SCENARIOS = {
+    "command bot": {"preload": "", "faq_handler": ""},
+    "command bot, ML stack imported": {
+        "preload": "import numpy, sentence_transformers",
+        "faq_handler": "",
+    },
+}
+
+
+def run(script: str, cwd: str):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", script], cwd=cwd, stdout=subprocess.PIPE)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    output = process.stdout.read().decode().strip().splitlines()
+    process.stdout.close()
+    if status != 0:
+        raise Exception(f"Benchmark scenario failed with status {status}")
+    # ru_maxrss is reported in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024, output[-1] if output else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faq", help="FAQ json to also measure a bot with a FAQ handler")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    if args.faq:
+        scenarios["faq bot"] = {"preload": "", "faq_handler": FAQ_HANDLER.format(faq=str(Path(args.faq).resolve()))}
+
+    print(f"{'scenario':<34}{'time, s':>10}{'peak RSS, MB':>15}  heavy modules loaded")
+    with tempfile.TemporaryDirectory() as cwd:
+        for name, parts in scenarios.items():
+            script = SETUP.format(root=str(ROOT), **parts)
+            results = [run(script, cwd) for _ in range(args.repeat)]
+            elapsed = min(result[0] for result in results)
+            rss = min(result[1] for result in results)
+            print(f"{name:<34}{elapsed:>10.2f}{rss:>15.1f}  {results[-1][2]}")
+
+
+if __name__ == "__main__":
+    main()
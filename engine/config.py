@@ -1,3 +1,43 @@
 ERROR = (
     "Ой, кажется что-то пошло не так :("
 )
+
+FAQ_TOP_K = 10
+
+ENCODE_BATCH_SIZE = 32
+
+EMBEDDING_CHUNK_SIZE = 256
+
+CONTEXT_FLUSH_INTERVAL = 1.0
+
+USER_CACHE_SIZE = 100000
+
+BROADCAST_WORKERS = 4
+
+BROADCAST_RATE = 30
+
+BROADCAST_CHAT_RATE = 1
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+
+LOG_BACKUP_COUNT = 5
+
+LOG_MAX_LENGTH = 2000
+
+UPDATE_WORKERS = 1
+
+UPDATE_QUEUE_SIZE = 1000
+
+WEBHOOK_WORKERS = 4
+
+SEND_WORKERS = 8
+
+SEND_QUEUE_SIZE = 0
+
+KEYBOARD_CACHE_SIZE = 1024
+
+FAQ_CACHE_SIZE = 10000
+
+FAQ_CACHE_TTL = 3600.0
+
+FAQ_WATCH_INTERVAL = 5.0
@@ -1,16 +1,40 @@
-from pathlib import Path
-
 import logging
 import os
-import sys
+import threading
 
-from typing import Optional, Callable, List
+from typing import Optional, Callable, List, Union, Iterable, TYPE_CHECKING
 
 from telegram import Update
 from telegram.ext import (Updater, CallbackContext)
 
-from engine.config import ERROR
+from engine.config import (
+    ERROR,
+    CONTEXT_FLUSH_INTERVAL,
+    USER_CACHE_SIZE,
+    BROADCAST_WORKERS,
+    UPDATE_WORKERS,
+    UPDATE_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    SEND_WORKERS,
+    SEND_QUEUE_SIZE,
+    FAQ_CACHE_SIZE,
+    FAQ_CACHE_TTL,
+    FAQ_WATCH_INTERVAL,
+)
+from .broadcast import Broadcaster
+from .context_store import ContextStore, FileContextStore
+from .executor import ShardedExecutor
+from .faq_cache import FaqResultCache
 from .handler import UniHandler
+from .logger import LogPipeline
+from .media_cache import MediaCache
+from .metrics import Metrics
+from .router import UniRouter
+from .sender import SendQueue
+from .update_cache import UpdateCache
+from .user_cache import UserDataCache
+from .user_registry import UserRegistry
+from .webhook import WebhookServer
 from .content import (
     Image,
     Video,
@@ -19,6 +43,27 @@ from .content import (
     Keyboard, Animation, Default
 )
 
+if TYPE_CHECKING:
+    from engine.faq_models.search import SearchBackend
+
+
+def call_now(func: Callable, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+SEND_METHODS = (
+    "send_message",
+    "send_photo",
+    "send_video",
+    "send_audio",
+    "send_animation",
+    "send_document",
+    "send_media_group",
+    "edit_message_text",
+    "edit_message_media",
+    "edit_message_caption",
+)
+
 
 class TelegramBot(Updater):
 
@@ -29,9 +74,27 @@ class TelegramBot(Updater):
             bot_name: str,
             dev_mode: Optional[str] = "n",
             request_kwargs: Optional[dict] = None,
+            context_store: Optional[ContextStore] = None,
+            user_registry: Optional[UserRegistry] = None,
+            user_cache_size: Optional[int] = USER_CACHE_SIZE,
+            user_cache_ttl: Optional[float] = None,
+            media_cache: Optional[MediaCache] = None,
+            metrics_port: Optional[int] = None,
+            update_workers: int = UPDATE_WORKERS,
+            send_workers: int = SEND_WORKERS,
+            base_url: Optional[str] = None,
+            faq_cache_size: int = FAQ_CACHE_SIZE,
+            faq_cache_ttl: Optional[float] = FAQ_CACHE_TTL,
     ):
+        request_kwargs = dict(request_kwargs or {})
+        # every thread that calls the Bot API keeps its own connection alive
+        request_kwargs.setdefault(
+            "con_pool_size",
+            send_workers + max(update_workers, WEBHOOK_WORKERS) + BROADCAST_WORKERS + 4
+        )
         super().__init__(
             token=token,
+            base_url=base_url,
             use_context=use_context,
             request_kwargs=request_kwargs
         )
@@ -39,30 +102,56 @@ class TelegramBot(Updater):
         logging_level = logging.DEBUG if dev_mode == "y" else logging.INFO
         self.bot_name = bot_name
         self.logger = logging.getLogger()
-        self.logger.setLevel(logging_level)
-        self.formatter = logging.Formatter("%(asctime)s %(message)s")
+        LogPipeline.setup(self.bot_name, logging_level)
+        self.dispatcher.add_error_handler(self.error)
 
-        self.debug_logger = logging.StreamHandler(sys.stdout)
-        self.debug_logger.setLevel(logging_level)
-        self.debug_logger.setFormatter(self.formatter)
-        self.logger.addHandler(self.debug_logger)
+        self.context_store = context_store or FileContextStore(f"/tmp/{self.bot_name}/contexts")
+        # contexts of users are loaded from the store on their first update after a restart
+        self.dispatcher.user_data = UserDataCache(self.context_store, user_cache_size, user_cache_ttl)
+        self.context_store.start(CONTEXT_FLUSH_INTERVAL)
+        self.user_registry = user_registry or UserRegistry(f"/tmp/{self.bot_name}/users.sqlite3")
+        # users known before the registry existed are taken from the context store once
+        self.user_registry.migrate(self.context_store)
+        self.user_registry.start(CONTEXT_FLUSH_INTERVAL)
+        self.media_cache = media_cache or MediaCache(f"/tmp/{self.bot_name}/media_cache.json")
+        self.faq_cache = FaqResultCache(faq_cache_size, faq_cache_ttl)
+        self.faq_watcher: Optional[threading.Thread] = None
+        self.faq_watcher_stop = threading.Event()
 
-        if not os.path.exists(Path(f"{os.curdir}/logs")):
-            os.mkdir(Path(f"{os.curdir}/logs"))
+        self.dispatcher_process_update = self.dispatcher.process_update
+        self.dispatcher.process_update = self.process_update
+        # updates of different users are handled in parallel, updates of one user in order
+        self.update_executor = ShardedExecutor(
+            update_workers, UPDATE_QUEUE_SIZE, name="Updates"
+        ) if update_workers > 1 else None
+        self.webhook_server: Optional[WebhookServer] = None
+        Metrics.register_gauge(
+            "uni_update_queue_depth",
+            lambda: self.update_executor.depth() if self.update_executor else 0
+        )
 
-        self.file_handler_logger = logging.FileHandler(
-            f"{os.curdir}/logs/{self.bot_name}.log",
-            encoding="utf8"
+        self.send_queue = SendQueue(
+            min(send_workers, request_kwargs["con_pool_size"]), SEND_QUEUE_SIZE
+        ) if send_workers > 0 else None
+        Metrics.register_gauge(
+            "uni_send_queue_depth",
+            lambda: self.send_queue.depth() if self.send_queue else 0
         )
-        self.file_handler_logger.setFormatter(self.formatter)
-        self.file_handler_logger.setLevel(logging_level)
-        self.logger.addHandler(self.file_handler_logger)
-        self.dispatcher.add_error_handler(self.error)
+
+        for method in SEND_METHODS:
+            setattr(self.bot, method, Metrics.timed(method, getattr(self.bot, method)))
+        Metrics.register_gauge("uni_user_cache_size", lambda: len(self.dispatcher.user_data))
+        Metrics.register_gauge("uni_faq_cache_size", lambda: len(self.faq_cache))
+        if metrics_port is not None:
+            Metrics.serve(metrics_port)
 
     def bot_handler(
             self,
             faq_json_path: str = None,
             similarity_score: float = 0.5,
+            faq_backend: Optional[Union[str, "SearchBackend"]] = None,
+            faq_top_k: Optional[int] = None,
+            faq_dtype: str = "float32",
             phrases: List[str] = (),
             file_types: List[str] = (),
             state: List[str] = None,
@@ -76,9 +165,15 @@ class TelegramBot(Updater):
                 callback_func=func,
                 dispatcher=self.dispatcher,
                 bot_name=self.bot_name,
+                context_store=self.context_store,
+                user_registry=self.user_registry,
                 phrases=phrases,
                 faq_json_path=faq_json_path,
                 similarity_score=similarity_score,
+                faq_backend=faq_backend,
+                faq_top_k=faq_top_k,
+                faq_dtype=faq_dtype,
+                faq_cache=self.faq_cache,
                 file_types=file_types,
                 state=state,
                 priority=priority,
@@ -87,14 +182,120 @@ class TelegramBot(Updater):
             )
         return decorator
 
+    def start_webhook_server(
+            self,
+            listen: str = "127.0.0.1",
+            port: int = 8443,
+            url_path: str = "webhook",
+            webhook_url: Optional[str] = None,
+            workers: int = WEBHOOK_WORKERS,
+            queue_size: int = UPDATE_QUEUE_SIZE,
+            overflow: str = "block",
+            block_timeout: float = 5.0,
+            record_path: Optional[str] = None,
+    ) -> WebhookServer:
+        """
+        Take updates from a local HTTP server instead of polling, `webhook_url` is
+        registered with Telegram when given. Updates wait in a queue of `queue_size`
+        updates per worker, see WebhookServer for the `overflow` policies
+        """
+        if self.update_executor is not None:
+            self.update_executor.shutdown()
+        self.update_executor = ShardedExecutor(workers, queue_size, name="Updates")
+        self.webhook_server = WebhookServer(
+            bot=self,
+            listen=listen,
+            port=port,
+            url_path=url_path,
+            overflow=overflow,
+            block_timeout=block_timeout,
+            record_path=record_path,
+        )
+        threading.Thread(target=self.webhook_server.serve_forever, name="Webhook", daemon=True).start()
+        if webhook_url is not None:
+            self.bot.set_webhook(url=webhook_url)
+        self.running = True
+        self.bot.logger.warning(f'Webhook listening on {listen}:{port}/{url_path.lstrip("/")}')
+        return self.webhook_server
+
+    def reload_faq(self, faq_json_path: Optional[str] = None) -> int:
+        """
+        Re-read the FAQ files of the handlers (or one of them) and swap in indexes of the changed ones.
+        Updates are handled with the old indexes while the new ones are built
+        """
+        from engine.faq_models.index import FaqIndex
+
+        replaced = FaqIndex.reload(faq_json_path)
+        for old, new in replaced:
+            self.faq_cache.invalidate(old.version)
+            self.logger.info(f"FAQ {new.key[0]} reloaded, {len(new.keys)} intents")
+        return len(replaced)
+
+    def watch_faq(self, interval: float = FAQ_WATCH_INTERVAL) -> None:
+        """Reload FAQ files when they are modified, checked every `interval` seconds"""
+        if self.faq_watcher is not None:
+            return
+        self.faq_watcher = threading.Thread(
+            target=self.run_faq_watcher, args=(interval,), name="FaqWatcher", daemon=True
+        )
+        self.faq_watcher.start()
+
+    def run_faq_watcher(self, interval: float) -> None:
+        from engine.faq_models.index import FaqIndex
+
+        mtimes = {}
+        while not self.faq_watcher_stop.wait(interval):
+            for path in FaqIndex.paths():
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                if mtimes.get(path) == mtime:
+                    continue
+                mtimes[path] = mtime
+                try:
+                    self.reload_faq(path)
+                except Exception as exc:
+                    self.logger.warning(f"Reloading FAQ {path} caused error {exc}")
+
+    def stop(self):
+        self.faq_watcher_stop.set()
+        if self.webhook_server is not None:
+            self.webhook_server.shutdown()
+            self.webhook_server.server_close()
+            self.webhook_server = None
+        super().stop()
+        if self.update_executor is not None:
+            self.update_executor.shutdown()
+        if self.send_queue is not None:
+            self.send_queue.shutdown()
+        self.user_registry.close()
+        self.context_store.close()
+
+    def process_update(self, update: Update) -> None:
+        if self.update_executor is None or not isinstance(update, Update):
+            self.run_update(update)
+            return
+        user = update.effective_user or update.effective_chat
+        self.update_executor.submit(user.id if user else update.update_id, self.run_update, update)
+
+    def run_update(self, update: Update) -> None:
+        try:
+            with Metrics.timer("update"):
+                self.dispatcher_process_update(update)
+        finally:
+            UpdateCache.release(update)
+
     def add_handlers(self):
         handlers_storage = sorted(
             UniHandler.handler_storage,
             key=lambda priority: priority[1],
             reverse=True
         )
-        for handle in handlers_storage:
-            self.dispatcher.add_handler(handle[0])
+        self.dispatcher.add_handler(UniRouter(
+            handlers=[handle[0] for handle in handlers_storage],
+            dispatcher=self.dispatcher,
+        ))
         self.bot.logger.warning('Start polling')
 
     def error(
@@ -118,8 +319,72 @@ class TelegramBot(Updater):
             audio: Optional[Audio] = Default,
             document: Optional[Document] = Default,
             animation: Optional[Animation] = Default,
-            keyboard: Optional[Keyboard] = Default,
+            keyboard: Optional[Union[Keyboard, str]] = Default,
+    ) -> None:
+        """Queue a response, it is sent in the background in order with other messages of the chat"""
+        self.send_response(
+            user_id=user_id,
+            message=message,
+            image=image,
+            video=video,
+            audio=audio,
+            document=document,
+            animation=animation,
+            keyboard=keyboard,
+            call=self.queued_call(user_id)
+        )
+
+    def edit_message_processing(
+            self,
+            user_id: str,
+            message_id: int,
+            text: Optional[str] = "",
+            image: Optional[Image] = Default,
+            video: Optional[Video] = Default,
+            audio: Optional[Audio] = Default,
+            document: Optional[Document] = Default,
+            animation: Optional[Animation] = Default,
+            keyboard: Optional[Union[Keyboard, str]] = Default,
+    ) -> None:
+        """Queue an edit, it is made in the background in order with other messages of the chat"""
+        self.edit_response(
+            user_id=user_id,
+            message_id=message_id,
+            text=text,
+            image=image,
+            video=video,
+            audio=audio,
+            document=document,
+            animation=animation,
+            keyboard=keyboard,
+            call=self.queued_call(user_id)
+        )
+
+    def queued_call(self, user_id: str) -> Callable:
+        if self.send_queue is None:
+            return call_now
+
+        def call(func: Callable, *args, **kwargs) -> None:
+            # file objects are read now, the handler may close them before a send worker gets the call
+            args = tuple(self.media_cache.prepare(arg) for arg in args)
+            kwargs = {name: self.media_cache.prepare(value) for name, value in kwargs.items()}
+            self.send_queue.submit(user_id, func, args, kwargs)
+        return call
+
+    def send_response(
+            self,
+            user_id: str,
+            message: Optional[str] = "",
+            image: Optional[Image] = Default,
+            video: Optional[Video] = Default,
+            audio: Optional[Audio] = Default,
+            document: Optional[Document] = Default,
+            animation: Optional[Animation] = Default,
+            keyboard: Optional[Union[Keyboard, str]] = Default,
+            call: Callable = call_now,
     ) -> None:
+        """Send a response, every Bot API request is made through `call`"""
+        keyboard = Keyboard.get(keyboard)
         if len(image.media + video.media) > 10 or\
                 (image.media and len(image.media) > 10) or\
                 (video.media and len(video.media) > 10):
@@ -128,66 +393,70 @@ class TelegramBot(Updater):
                 (image.media and 1 < len(image.media) <= 10) or \
                 (video.media and 1 < len(video.media) <= 10):
             if len(image.media + video.media) <= 10:
-                self.bot.send_media_group(
+                call(
+                    self.media_cache.send_group,
+                    self.bot.send_media_group,
+                    image.media + video.media,
                     chat_id=user_id,
-                    media=(image.media + video.media),
                 )
-                self.bot.send_message(
+                call(
+                    self.bot.send_message,
                     chat_id=user_id,
                     text=message,
                     parse_mode="Markdown",
-                    reply_markup=keyboard.keyboard
+                    reply_markup=keyboard.markup
                 )
 
         elif image.media:
-            self.bot.send_photo(
+            call(
+                self.media_cache.send, self.bot.send_photo, "photo", image.media[0],
                 chat_id=user_id,
-                photo=image.media[0],
                 caption=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
         elif video.media:
-            self.bot.send_video(
+            call(
+                self.media_cache.send, self.bot.send_video, "video", video.media[0],
                 chat_id=user_id,
-                video=video.media[0],
                 caption=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
         elif audio.media:
-            self.bot.send_audio(
+            call(
+                self.media_cache.send, self.bot.send_audio, "audio", audio.media,
                 chat_id=user_id,
-                audio=audio.media,
                 caption=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
         elif animation.media:
-            self.bot.send_animation(
+            call(
+                self.media_cache.send, self.bot.send_animation, "animation", animation.media,
                 chat_id=user_id,
-                animation=animation.media,
                 caption=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
         elif document.media:
-            self.bot.send_document(
+            call(
+                self.media_cache.send, self.bot.send_document, "document", document.media,
                 chat_id=user_id,
-                document=document.media,
                 caption=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
         else:
-            self.bot.send_message(
+            call(
+                self.bot.send_message,
                 chat_id=user_id,
                 text=message,
                 parse_mode="Markdown",
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
 
-    def edit_message_processing(
+    def edit_response(
             self,
             user_id: str,
             message_id: int,
@@ -197,8 +466,11 @@ class TelegramBot(Updater):
             audio: Optional[Audio] = Default,
             document: Optional[Document] = Default,
             animation: Optional[Animation] = Default,
-            keyboard: Optional[Keyboard] = Default,
+            keyboard: Optional[Union[Keyboard, str]] = Default,
+            call: Callable = call_now,
     ) -> None:
+        """Edit a sent message, every Bot API request is made through `call`"""
+        keyboard = Keyboard.get(keyboard)
 
         if len(image.media + video.media) > 1 or\
                 (image.media and len(image.media) > 1) or\
@@ -207,64 +479,73 @@ class TelegramBot(Updater):
 
         for media in [image.media, video.media, audio.media, animation.media, document.media]:
             if media:
-                self.bot.edit_message_media(
+                call(
+                    self.bot.edit_message_media,
                     chat_id=user_id,
                     message_id=message_id,
                     media=media,
                     caption=text,
-                    reply_markup=keyboard.keyboard
+                    reply_markup=keyboard.markup
                 )
-                self.bot.edit_message_caption(
+                call(
+                    self.bot.edit_message_caption,
                     chat_id=user_id,
                     message_id=message_id,
                     parse_mode="Markdown",
                     caption=text,
-                    reply_markup=keyboard.keyboard
+                    reply_markup=keyboard.markup
                 )
                 break
         else:
-            self.bot.edit_message_text(
+            call(
+                self.bot.edit_message_text,
                 chat_id=user_id,
                 message_id=message_id,
                 parse_mode="Markdown",
                 text=text,
-                reply_markup=keyboard.keyboard
+                reply_markup=keyboard.markup
             )
 
     def id_counter(self) -> List:
-        all_contexts = os.listdir(f"/tmp/{self.bot_name}/contexts")
-        all_ids = [int(file.split(sep='.')[0]) for file in all_contexts]
-        return all_ids
+        return list(self.user_registry.iter_ids())
 
     def broadcast(
             self,
-            user_ids: Optional[List] = None,
+            user_ids: Optional[Iterable] = None,
             message: Optional[str] = "",
             image: Optional[Image] = Default,
             video: Optional[Video] = Default,
             audio: Optional[Audio] = Default,
             document: Optional[Document] = Default,
             animation: Optional[Animation] = Default,
-            keyboard: Optional[Keyboard] = Default,
+            keyboard: Optional[Union[Keyboard, str]] = Default,
+            workers: int = BROADCAST_WORKERS,
+            checkpoint_path: Optional[str] = None,
     ) -> int:
         if user_ids is None:
-            user_ids = self.id_counter()
-        final_amount = 0
-        for user in user_ids:
-            try:
-                self.response_processing(
-                    user_id=user,
-                    message=message,
-                    image=image,
-                    video=video,
-                    audio=audio,
-                    document=document,
-                    animation=animation,
-                    keyboard=keyboard
-                )
-                final_amount += 1
-            except Exception as exc:
-                self.bot.logger.warning(
-                    f'Broadcast to user {str(user)} caused error {exc}'
-                )
-        return final_amount
+            # recipients are streamed from the registry, any segment of it can be passed instead,
+            # e.g. bot.user_registry.iter_ids(state="paid")
+            user_ids = self.user_registry.iter_ids()
+        keyboard = Keyboard.get(keyboard)
+
+        def send(user: int) -> None:
+            self.send_response(
+                user_id=user,
+                message=message,
+                image=image,
+                video=video,
+                audio=audio,
+                document=document,
+                animation=animation,
+                keyboard=keyboard
+            )
+
+        # a media group is followed by a separate text message
+        requests_per_user = 2 if len(image.media + video.media) > 1 else 1
+        broadcaster = Broadcaster(
+            send=send,
+            requests_per_user=requests_per_user,
+            workers=workers,
+            checkpoint_path=checkpoint_path,
+        )
+        return broadcaster.run(user_ids).sent
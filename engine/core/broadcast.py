@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from queue import Queue, Empty
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+
+from engine.config import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_WORKERS
+
+
+class TokenBucket:
+    """
+    Allows `rate` tokens per second with bursts of up to `capacity` tokens
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"sent {self.sent}, failed {self.failed}, skipped {self.skipped}, "
+            f"retried {self.retried}, {self.throughput:.1f} messages/s"
+        )
+
+
+class Broadcaster:
+    """
+    Sends to many users from a pool of workers within the global and per-chat limits of Telegram.
+    RetryAfter pauses every worker and requeues the user, processed users are appended
+    to `checkpoint_path` so an interrupted broadcast resumes where it stopped
+    """
+
+    def __init__(
+            self,
+            send: Callable[[int], None],
+            requests_per_user: int = 1,
+            workers: int = BROADCAST_WORKERS,
+            rate: float = BROADCAST_RATE,
+            chat_rate: float = BROADCAST_CHAT_RATE,
+            checkpoint_path: Optional[str] = None,
+            max_retries: int = 3,
+            report_interval: float = 10,
+    ):
+        self.send = send
+        self.requests_per_user = requests_per_user
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = requests_per_user / chat_rate
+        self.checkpoint_path = checkpoint_path
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self.logger = logging.getLogger()
+
+        self.stats = BroadcastStats()
+        self.queue: "Queue[Tuple[int, int]]" = Queue(maxsize=workers * 4)
+        self.retries: "Queue[Tuple[int, int]]" = Queue()
+        self.chat_ready: Dict[int, float] = {}
+        self.pending = 0
+        self.produced = False
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.checkpoint = None
+
+    def run(self, user_ids: Iterable[int]) -> BroadcastStats:
+        processed = self.read_checkpoint()
+        if self.checkpoint_path:
+            # line buffered, so a killed broadcast resends to no user that is already in the file
+            self.checkpoint = open(self.checkpoint_path, "a", encoding="utf-8", buffering=1)
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=self.work, name=f"Broadcast-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        reporter = threading.Thread(target=self.report, args=(start,), name="BroadcastReport", daemon=True)
+        reporter.start()
+        try:
+            for user_id in user_ids:
+                if user_id in processed:
+                    self.stats.skipped += 1
+                    continue
+                with self.lock:
+                    self.pending += 1
+                self.queue.put((user_id, 0))
+            with self.lock:
+                self.produced = True
+                if not self.pending:
+                    self.done.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            # an interrupted broadcast stops the workers before the checkpoint is closed
+            self.done.set()
+            for thread in threads:
+                thread.join()
+            self.stats.elapsed = time.monotonic() - start
+            if self.checkpoint:
+                with self.lock:
+                    self.checkpoint.close()
+        self.logger.warning(f"Broadcast finished: {self.stats}")
+        return self.stats
+
+    def read_checkpoint(self) -> Set[int]:
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+                return {int(line) for line in file if line.strip()}
+        except (TypeError, FileNotFoundError):
+            return set()
+
+    def work(self) -> None:
+        while not self.done.is_set():
+            try:
+                user_id, attempt = self.retries.get_nowait()
+            except Empty:
+                try:
+                    user_id, attempt = self.queue.get(timeout=0.1)
+                except Empty:
+                    continue
+            self.process(user_id, attempt)
+
+    def process(self, user_id: int, attempt: int) -> None:
+        wait = self.chat_ready.get(user_id, 0) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.bucket.acquire(self.requests_per_user)
+        try:
+            self.send(user_id)
+        except RetryAfter as exc:
+            # flood control is global, so every worker waits
+            self.bucket.pause(exc.retry_after)
+            self.retry(user_id, attempt, exc.retry_after, exc, count_attempt=False)
+            return
+        except (Unauthorized, BadRequest) as exc:
+            self.finish(user_id, False, exc)
+            return
+        except (TimedOut, NetworkError) as exc:
+            self.retry(user_id, attempt, 2 ** attempt, exc)
+            return
+        except Exception as exc:
+            self.finish(user_id, False, exc)
+            return
+        self.finish(user_id, True)
+
+    def retry(self, user_id: int, attempt: int, delay: float, exc: Exception, count_attempt: bool = True) -> None:
+        if count_attempt and attempt >= self.max_retries:
+            self.finish(user_id, False, exc)
+            return
+        with self.lock:
+            self.stats.retried += 1
+        self.chat_ready[user_id] = time.monotonic() + max(delay, self.chat_interval)
+        self.retries.put((user_id, attempt + 1 if count_attempt else attempt))
+
+    def finish(self, user_id: int, sent: bool, exc: Optional[Exception] = None) -> None:
+        self.chat_ready.pop(user_id, None)
+        with self.lock:
+            if sent:
+                self.stats.sent += 1
+            else:
+                self.stats.failed += 1
+                # failures are sampled after the first hundred, the totals are in the progress reports
+                if self.stats.failed <= 100 or self.stats.failed % 100 == 0:
+                    self.logger.warning(f'Broadcast to user {str(user_id)} caused error {exc}')
+            if self.checkpoint:
+                self.checkpoint.write(f"{user_id}\n")
+            self.pending -= 1
+            if self.produced and not self.pending:
+                self.done.set()
+
+    def report(self, start: float) -> None:
+        while not self.done.wait(self.report_interval):
+            self.stats.elapsed = time.monotonic() - start
+            self.logger.warning(f"Broadcast in progress: {self.stats}")
@@ -1,6 +1,11 @@
+import json
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
-from typing import Optional, List, Union, BinaryIO
+from typing import Optional, List, Union, BinaryIO, Dict, Tuple
+
+from engine.config import KEYBOARD_CACHE_SIZE
 
 from telegram import (
     InputMediaPhoto,
@@ -72,16 +77,47 @@ class Animation:
 class Default:
     media = []
     keyboard = ReplyKeyboardRemove()
+    markup = keyboard.to_json()
 
 
 class Keyboard:
-    def __init__(
+    """
+    Keyboards are interned by layout, so a layout in use is built and serialized once.
+    Up to KEYBOARD_CACHE_SIZE recently used layouts are kept, keyboards named with `Keyboard.register`
+    are kept for good. `markup` is the serialized reply_markup that is sent
+    """
+
+    interned: "OrderedDict[Tuple[str, bool], Keyboard]" = OrderedDict()
+    max_interned = KEYBOARD_CACHE_SIZE
+    registry: Dict[str, "Keyboard"] = {}
+    lock = threading.Lock()
+
+    def __new__(
+            cls,
+            keyboard: List[List[Union[dict, str]]] = None,
+            inline_mode: Optional[bool] = False,
+    ):
+        key = (json.dumps(keyboard or [], sort_keys=True, default=str), bool(inline_mode))
+        with cls.lock:
+            if key in cls.interned:
+                cls.interned.move_to_end(key)
+                return cls.interned[key]
+        # keyboards built per user or per page are evicted, the least recently used first
+        instance = super().__new__(cls)
+        instance.build(keyboard, inline_mode)
+        with cls.lock:
+            instance = cls.interned.setdefault(key, instance)
+            while len(cls.interned) > cls.max_interned:
+                cls.interned.popitem(last=False)
+        return instance
+
+    def build(
             self,
             keyboard: List[List[Union[dict, str]]] = None,
             inline_mode: Optional[bool] = False,
     ):
         if not keyboard:
-            self.keyboard = ReplyKeyboardRemove
+            self.keyboard = ReplyKeyboardRemove()
         else:
             formatted_keyboard = []
             for _string in keyboard:
@@ -108,3 +144,22 @@ class Keyboard:
                     one_time_keyboard=True,
                     resize_keyboard=True,
                 )
+        self.markup = self.keyboard.to_json()
+
+    @classmethod
+    def register(
+            cls,
+            name: str,
+            keyboard: List[List[Union[dict, str]]] = None,
+            inline_mode: Optional[bool] = False,
+    ) -> "Keyboard":
+        cls.registry[name] = cls(keyboard, inline_mode)
+        return cls.registry[name]
+
+    @classmethod
+    def get(cls, keyboard: Union["Keyboard", str]) -> "Keyboard":
+        if not isinstance(keyboard, str):
+            return keyboard
+        if keyboard not in cls.registry:
+            raise Exception(f'Unknown keyboard "{keyboard}", register it with Keyboard.register')
+        return cls.registry[keyboard]
@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from engine.core.flusher import PeriodicFlusher
+from engine.core.metrics import Metrics
+
+SERIALIZERS: Dict[str, Tuple[Callable[[dict], bytes], Callable[[bytes], dict]]] = {
+    "json": (lambda context: json.dumps(context).encode("utf-8"), json.loads),
+    "binary": (lambda context: pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+}
+
+
+class ContextStore(PeriodicFlusher):
+    """
+    Storage of user contexts with write-behind: `save` only marks a context as dirty
+    and dirty contexts are written in one batch by `flush`, which runs on a timer
+    """
+
+    flushed = "user contexts"
+
+    def __init__(self, serializer: str = "json"):
+        super().__init__()
+        if serializer not in SERIALIZERS:
+            raise Exception(f"Unknown context serializer {serializer}, expected one of {list(SERIALIZERS)}")
+        self.serializer = serializer
+        self.dumps, self.loads = SERIALIZERS[serializer]
+        self.dirty: Dict[int, dict] = {}
+        # contexts taken by a flush stay visible to `load` until they are written
+        self.flushing: Dict[int, dict] = {}
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+
+    def save(self, context: dict) -> None:
+        with self.lock:
+            self.dirty[context["id"]] = context
+
+    def load(self, user_id: int) -> Optional[dict]:
+        with self.lock:
+            if user_id in self.dirty:
+                return self.dirty[user_id]
+            if user_id in self.flushing:
+                return self.flushing[user_id]
+        with self.io_lock:
+            data = self.read(user_id)
+        return self.loads(data) if data is not None else None
+
+    def flush(self) -> None:
+        with self.lock:
+            batch, self.dirty = self.dirty, {}
+            self.flushing.update(batch)
+        records = {}
+        try:
+            for user_id, context in batch.items():
+                try:
+                    records[user_id] = self.dumps(context)
+                except Exception as exc:
+                    # a handler thread changed the context while it was serialized (RuntimeError),
+                    # or it holds a value the serializer can not write, the rest of the batch is written
+                    if not isinstance(exc, RuntimeError):
+                        logging.getLogger().warning(f"Context of user {user_id} can not be saved: {exc}")
+                    with self.lock:
+                        self.dirty.setdefault(user_id, context)
+            if records:
+                try:
+                    with self.io_lock, Metrics.timer("context_flush"):
+                        self.write(records)
+                except Exception:
+                    # the batch stays dirty and is written again by the next flush
+                    with self.lock:
+                        for user_id in records:
+                            self.dirty.setdefault(user_id, batch[user_id])
+                    raise
+        finally:
+            with self.lock:
+                for user_id, context in batch.items():
+                    if self.flushing.get(user_id) is context:
+                        del self.flushing[user_id]
+
+    def read(self, user_id: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def write(self, records: Dict[int, bytes]) -> None:
+        raise NotImplementedError
+
+    def user_ids(self) -> Iterator[int]:
+        raise NotImplementedError
+
+
+class FileContextStore(ContextStore):
+    """
+    One file per user in `directory`
+    """
+
+    def __init__(self, directory: str, serializer: str = "json"):
+        super().__init__(serializer)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.suffix = ".json" if serializer == "json" else ".bin"
+
+    def read(self, user_id: int) -> Optional[bytes]:
+        try:
+            with open(self.directory / f"{user_id}{self.suffix}", "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, records: Dict[int, bytes]) -> None:
+        for user_id, data in records.items():
+            path = self.directory / f"{user_id}{self.suffix}"
+            with open(f"{path}.tmp", "wb") as file:
+                file.write(data)
+            os.replace(f"{path}.tmp", path)
+
+    def user_ids(self) -> Iterator[int]:
+        for name in os.listdir(self.directory):
+            # files that are not named by a user id are skipped
+            if name.endswith(self.suffix) and name[:-len(self.suffix)].lstrip("-").isdigit():
+                yield int(name[:-len(self.suffix)])
+
+
+class SqliteContextStore(ContextStore):
+    """
+    Contexts in one SQLite table, written in WAL mode with one transaction per flush
+    """
+
+    def __init__(self, path: str, serializer: str = "json"):
+        super().__init__(serializer)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS contexts (id INTEGER PRIMARY KEY, data BLOB)")
+        self.connection.commit()
+
+    def read(self, user_id: int) -> Optional[bytes]:
+        row = self.connection.execute("SELECT data FROM contexts WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def write(self, records: Dict[int, bytes]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO contexts (id, data) VALUES (?, ?)",
+                records.items()
+            )
+
+    def user_ids(self) -> Iterator[int]:
+        with self.io_lock:
+            ids = [row[0] for row in self.connection.execute("SELECT id FROM contexts")]
+        return iter(ids)
+
+    def close(self) -> None:
+        if self.stop_event.is_set():
+            return
+        super().close()
+        with self.io_lock:
+            self.connection.close()
+
+
+class AppendLogContextStore(ContextStore):
+    """
+    Contexts appended to a single log file, the latest record of a user wins.
+    Offsets of the latest records are kept in memory and the log is compacted
+    on open when most of it is outdated
+    """
+
+    record_header = struct.Struct(">qI")
+
+    def __init__(self, path: str, serializer: str = "json"):
+        super().__init__(serializer)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch(exist_ok=True)
+        self.offsets: Dict[int, Tuple[int, int]] = {}
+        self.scan()
+        live_size = sum(size + self.record_header.size for _, size in self.offsets.values())
+        if self.path.stat().st_size > 2 * live_size:
+            self.compact()
+        self.file = open(self.path, "r+b")
+
+    def scan(self) -> None:
+        with open(self.path, "rb") as file:
+            end = 0
+            while True:
+                header = file.read(self.record_header.size)
+                if len(header) < self.record_header.size:
+                    break
+                user_id, size = self.record_header.unpack(header)
+                if len(file.read(size)) < size:
+                    break
+                self.offsets[user_id] = (end + self.record_header.size, size)
+                end += self.record_header.size + size
+        # a record cut by a crash is dropped
+        os.truncate(self.path, end)
+
+    def compact(self) -> None:
+        records = {}
+        with open(self.path, "rb") as file:
+            for user_id, (offset, size) in self.offsets.items():
+                file.seek(offset)
+                records[user_id] = file.read(size)
+        with open(f"{self.path}.tmp", "wb") as file:
+            self.offsets = self.append(file, 0, records)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def append(self, file, end: int, records: Dict[int, bytes]) -> Dict[int, Tuple[int, int]]:
+        offsets = {}
+        chunks = []
+        for user_id, data in records.items():
+            chunks.append(self.record_header.pack(user_id, len(data)))
+            chunks.append(data)
+            offsets[user_id] = (end + self.record_header.size, len(data))
+            end += self.record_header.size + len(data)
+        file.write(b"".join(chunks))
+        file.flush()
+        return offsets
+
+    def read(self, user_id: int) -> Optional[bytes]:
+        if user_id not in self.offsets:
+            return None
+        offset, size = self.offsets[user_id]
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def write(self, records: Dict[int, bytes]) -> None:
+        end = self.file.seek(0, os.SEEK_END)
+        self.offsets.update(self.append(self.file, end, records))
+
+    def user_ids(self) -> Iterator[int]:
+        with self.io_lock:
+            ids = list(self.offsets)
+        return iter(ids)
+
+    def close(self) -> None:
+        if self.stop_event.is_set():
+            return
+        super().close()
+        with self.io_lock:
+            self.file.close()
@@ -0,0 +1,62 @@
+import logging
+import threading
+from queue import Queue, Full
+from typing import Callable, Hashable, List, Optional
+
+
+class ShardedExecutor:
+    """
+    Pool of workers with one bounded queue each. Tasks with the same key go to the same
+    worker, so tasks of one user run one at a time and in the order they were submitted
+    """
+
+    def __init__(self, workers: int, queue_size: int = 0, name: str = "Shard"):
+        self.queues: List[Queue] = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self.work, args=(queue,), name=f"{name}-{i}", daemon=True)
+            for i, queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(
+            self,
+            key: Hashable,
+            func: Callable,
+            *args,
+            block: bool = True,
+            timeout: Optional[float] = None
+    ) -> bool:
+        """Queue `func(*args)` on the worker of `key`, False if its queue stayed full"""
+        try:
+            self.queues[hash(key) % len(self.queues)].put((func, args), block=block, timeout=timeout)
+        except Full:
+            return False
+        return True
+
+    def work(self, queue: Queue) -> None:
+        while True:
+            task = queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                func(*args)
+            except Exception as exc:
+                logging.getLogger().warning(f"Task {task} caused error {exc}")
+            finally:
+                queue.task_done()
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def join(self) -> None:
+        """Wait until every submitted task is done"""
+        for queue in self.queues:
+            queue.join()
+
+    def shutdown(self) -> None:
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from engine.core.metrics import Metrics
+
+
+class FaqResultCache:
+    """
+    Bounded cache of FAQ search results, so a question typed the same way again
+    is neither encoded nor scored. Results are keyed by normalized text and the version
+    of the FAQ index, least recently used results and results older than `ttl` seconds are evicted
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data: "OrderedDict[Tuple, Tuple[Any, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(message: str, version: str, *options: Hashable) -> Tuple:
+        return (" ".join(message.casefold().split()), version) + options
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic() - self.ttl:
+                del self.data[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+        Metrics.increment("uni_faq_cache_total", "result", "miss" if entry is None else "hit")
+        return entry[0] if entry is not None else None
+
+    def put(self, key: Tuple, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = (value, time.monotonic())
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version: Optional[str] = None) -> None:
+        """Drop the results of one FAQ index version, or all of them"""
+        with self.lock:
+            if version is None:
+                self.data.clear()
+            else:
+                for key in [key for key in self.data if key[1] == version]:
+                    del self.data[key]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,22 +1,20 @@
-import json
-import re
-import numpy as np
-
-
 from pathlib import Path
 
 from datetime import datetime
 from typing import List, Optional, Dict
 
-from sklearn.metrics.pairwise import cosine_similarity
-
-from engine.faq_models.vectorizer import Vectorizer
+from engine.core.faq_cache import FaqResultCache
+from engine.core.matcher import PhraseMatcher
+from engine.core.metrics import Metrics
+from engine.core.update_cache import UpdateCache
+from engine.core.update_view import UpdateView
 
 from telegram import Update, Message, Chat
-from telegram.ext import BaseFilter, CallbackContext, Dispatcher
+from telegram.ext import BaseFilter, Dispatcher
 
 
 class UniFilter(BaseFilter):
+    phrase_matcher = PhraseMatcher()
 
     def __init__(
             self,
@@ -25,6 +23,10 @@ class UniFilter(BaseFilter):
             phrases: List[str],
             faq_json_path: Optional[str],
             similarity_score: float,
+            faq_backend,
+            faq_top_k: Optional[int],
+            faq_dtype: str,
+            faq_cache: FaqResultCache,
             file_types: List[str],
             state: List[str],
             inline_mode: bool,
@@ -32,26 +34,43 @@ class UniFilter(BaseFilter):
     ):
         self.faq_json_path = faq_json_path
         if self.faq_json_path is not None:
-            self.vectorizer = Vectorizer.model
-            with open(str(Path.cwd().absolute() / Path(self.faq_json_path)), "r+") as f:
-                self.faq_dict: Dict = json.load(f)
-
-            for key in self.faq_dict.keys():
-                self.faq_dict[key]["vectors"] = self.vectorizer.encode(
-                    self.faq_dict[key]["phrases"])
+            # the ML stack is imported only by bots that use FAQ handlers
+            from engine.faq_models.index import FaqIndex
+            from engine.faq_models.vectorizer import Vectorizer
+
+            self.vectorizer = Vectorizer.get_model()
+            # only the storage key is kept, so an index replaced by a reload can be freed
+            self.faq_storage = FaqIndex.storage
+            self.faq_key = FaqIndex.load(
+                str(Path.cwd().absolute() / Path(self.faq_json_path)),
+                dtype=faq_dtype,
+                backend=faq_backend,
+            ).key
 
         self.similarity_score = similarity_score
+        self.faq_top_k = faq_top_k
+        self.faq_cache = faq_cache
         self.bot_name = bot_name
         self.phrases = phrases
+        UniFilter.phrase_matcher.add(self, phrases)
         self.handler = handler
         self.file_types = file_types
         self.state = state
         self.dp = dispatcher
         self.inline_mode = inline_mode
 
+    @property
+    def faq_index(self):
+        return self.faq_storage[self.faq_key]
+
+    @property
+    def faq_dict(self) -> Dict:
+        return self.faq_index.faq_dict
+
     name = None
     update_filter = True
-    data_filter = False
+    # a match returns its payload, which reaches UniHandler.handle_update as check_result
+    data_filter = True
 
     def filter(self, update: Update):
         if not update.message and not update.callback_query:
@@ -60,68 +79,37 @@ class UniFilter(BaseFilter):
         conclusion = {
             "state": False,
             "file_type": False,
-            "phrase": False,
         }
-        context = CallbackContext.from_update(update, self.dp)
+        view = UpdateView.of(update, self.dp)
+        context = view.context
 
         if self.inline_mode:
             if update.callback_query:
-                data = update.to_dict()["callback_query"]["from"]
-                update.message = Message(
+                view.set_message(Message(
                     chat=Chat(id=update.callback_query.chat_instance, type='private'),
                     date=datetime.today(),
                     from_user=update.callback_query.from_user,
                     message_id=update.callback_query.id,
                     text=update.callback_query.data,
-                )
+                ))
             else:
                 return False
         else:
             if update.callback_query:
                 return False
-            data = update.to_dict()["message"]["from"]
+        user_id = view.user_id
 
-        if not context.user_data.get(data["id"]):
+        if not context.user_data.get(user_id):
             self.handler.collect_additional_context(context, update, self.dp, "_")
 
-        if getattr(update.message, "caption"):
-            mess = update.message.caption.lower()
-        elif getattr(update.message, "text"):
-            mess = update.message.text.lower()
-        else:
-            mess = None
-
-        if mess is not None and self.phrases == () or self.check_for_regex(mess, self.phrases):
-            conclusion["phrase"] = True
-
-        if mess is not None and self.faq_json_path:
-            faq_options = []
-            message_vector = self.vectorizer.encode([mess])
-            for key in self.faq_dict.keys():
-                max_score = np.max(cosine_similarity(message_vector, self.faq_dict[key]["vectors"]))
-                if max_score > self.similarity_score:
-                    conclusion["phrase"] = True
-                    faq_options.append(
-                        (key, {
-                            "phrases": self.faq_dict[key]["phrases"],
-                            "answer": self.faq_dict[key]["answer"],
-                            "metadata": self.faq_dict[key]["metadata"]
-                        }, max_score)
-                    )
-            if faq_options:
-                faq_options.sort(key=lambda x: x[2], reverse=True)
-                self.handler.handler_payload.update({"faq_answer": faq_options})
-            else:
-                conclusion["phrase"] = False
-
-        if not conclusion["phrase"]:
-            return False
-        if not self.state or context.user_data[data["id"]]["state"] in self.state:
-            conclusion["state"] = True
+        # cheap state and file type checks go first, FAQ scoring runs only if they pass
+        with Metrics.timer("state_check"):
+            if not self.state or context.user_data[user_id]["state"] in self.state:
+                conclusion["state"] = True
         if not conclusion["state"]:
             return False
         if self.file_types == ():
-            conclusion["file_type"] = False if self.check_for_docs(update.message) else True
+            conclusion["file_type"] = not view.has_media
         elif self.file_types == ["any"]:
             conclusion["file_type"] = True
         else:
@@ -133,24 +121,35 @@ class UniFilter(BaseFilter):
                     break
         if not conclusion["file_type"]:
             return False
-        return True
-
-    @staticmethod
-    def check_for_docs(message: Message) -> bool:
-        if hasattr(message, "document") and getattr(message, "document") or \
-                hasattr(message, "photo") and getattr(message, "photo") or \
-                hasattr(message, "audio") and getattr(message, "audio") or \
-                hasattr(message, "voice") and getattr(message, "voice") or \
-                hasattr(message, "video") and getattr(message, "video"):
+
+        mess = view.text
+
+        if mess is not None and self.faq_json_path:
+            # the index is read once, a search in progress keeps it when a reload swaps in a new one
+            faq_index = self.faq_index
+            key = self.faq_cache.key(mess, faq_index.version, self.similarity_score, self.faq_top_k)
+            result = self.faq_cache.get(key)
+            if result is None:
+                message_vector = UpdateCache.message_vector(update, mess, self.vectorizer)
+                with Metrics.timer("similarity"):
+                    faq_options = faq_index.search(
+                        message_vector, self.similarity_score, self.faq_top_k)
+                result = (faq_options, message_vector)
+                self.faq_cache.put(key, result)
+            faq_options, message_vector = result
+            if faq_options:
+                return {
+                    "faq_answer": list(faq_options),
+                    "message_vector": message_vector,
+                }
+        elif mess is not None and (self.phrases == () or self.check_for_phrases(update, mess)):
             return True
         return False
 
-    @staticmethod
-    def check_for_regex(
-            message: str,
-            phrase_pool: list
-    ) -> bool:
-        for phrase in phrase_pool:
-            if re.search(phrase.lower(), message):
-                return True
-        return False
+    def check_for_phrases(self, update: Update, message: str) -> bool:
+        # literal phrases of every handler are scanned once per update
+        with Metrics.timer("phrase_match"):
+            literal_matches = UpdateCache.get(update).setdefault("literal_matches", {})
+            if message not in literal_matches:
+                literal_matches[message] = UniFilter.phrase_matcher.scan(message)
+            return self in literal_matches[message] or UniFilter.phrase_matcher.search(self, message)
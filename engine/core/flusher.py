@@ -0,0 +1,40 @@
+import atexit
+import logging
+import threading
+from typing import Optional
+
+
+class PeriodicFlusher:
+    """
+    Base of write-behind storages: `flush` runs every `interval` seconds on a background thread
+    after `start`, and once more on `close`, which is also called at exit
+    """
+
+    flushed = "pending records"
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.timer: Optional[threading.Thread] = None
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def start(self, interval: float) -> None:
+        if self.timer is not None:
+            return
+        self.timer = threading.Thread(target=self.run, args=(interval,), name=type(self).__name__, daemon=True)
+        self.timer.start()
+        atexit.register(self.close)
+
+    def run(self, interval: float) -> None:
+        while not self.stop_event.wait(interval):
+            try:
+                self.flush()
+            except Exception as exc:
+                logging.getLogger().warning(f"Flushing {self.flushed} caused error {exc}")
+
+    def close(self) -> None:
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        self.flush()
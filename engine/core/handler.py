@@ -1,11 +1,12 @@
-import os
-
-import json
-from pathlib import Path
 from typing import Callable, List, Optional
 from telegram.ext import MessageHandler, Dispatcher, Filters
 
+from engine.core.context_store import ContextStore
+from engine.core.faq_cache import FaqResultCache
 from engine.core.filter import UniFilter
+from engine.core.metrics import Metrics
+from engine.core.update_view import UpdateView
+from engine.core.user_registry import UserRegistry
 
 
 class UniHandler(MessageHandler):
@@ -16,9 +17,15 @@ class UniHandler(MessageHandler):
             callback_func: Callable,
             dispatcher: Dispatcher,
             bot_name: str,
+            context_store: ContextStore,
+            user_registry: UserRegistry,
             file_types: List[str],
             faq_json_path: Optional[str],
             similarity_score: float,
+            faq_backend,
+            faq_top_k: Optional[int],
+            faq_dtype: str,
+            faq_cache: FaqResultCache,
             phrases: List[str],
             state: list,
             priority: int,
@@ -26,13 +33,20 @@ class UniHandler(MessageHandler):
             successful_payment: Optional[bool]
     ):
         self.bot_name = bot_name
-        self.handler_payload = {}
+        self.name = getattr(callback_func, "__name__", repr(callback_func))
+        self.context_store = context_store
+        self.user_registry = user_registry
+        self.successful_payment = successful_payment
         self.filter = UniFilter(
             bot_name=bot_name,
             handler=self,
             phrases=phrases,
             faq_json_path=faq_json_path,
             similarity_score=similarity_score,
+            faq_backend=faq_backend,
+            faq_top_k=faq_top_k,
+            faq_dtype=faq_dtype,
+            faq_cache=faq_cache,
             file_types=file_types,
             state=state,
             inline_mode=inline_mode,
@@ -53,30 +67,23 @@ class UniHandler(MessageHandler):
 
     def handle_update(self, update, dispatcher, check_result, context=None):
         self.collect_additional_context(context, update, dispatcher, check_result)
-        if update.message:
-            user_id = update.message.to_dict()["from"]["id"]
-        elif update.callback_query:
-            user_id = update.callback_query.to_dict()["from"]["id"]
-        else:
+        if not update.message and not update.callback_query:
             print("Unexpected update")
             return
-        final_update = update.to_dict()
-        final_update["handler_payload"] = self.handler_payload
-        return self.callback(final_update, context.user_data[user_id])
-
-    def update_file_context(self, context: dict):
-        with open(
-                Path(f"/tmp/{self.bot_name}/contexts") / f"{context['user_data']['id']}.json",
-                "w",
-                encoding='utf-8'
-        ) as file:
-            file.write(json.dumps(context))
+        view = UpdateView.of(update, dispatcher)
+        final_update = dict(view.dict)
+        # the payload of this update only, so updates can be handled concurrently
+        final_update["handler_payload"] = dict(check_result) if isinstance(check_result, dict) else {}
+        Metrics.increment("uni_handler_matches_total", "handler", self.name)
+        with Metrics.timer("callback"):
+            return self.callback(final_update, context.user_data[view.user_id])
 
     def collect_additional_context(self, context, update, dispatcher, check_result):
-        if not os.path.exists(Path(f"/tmp/{self.bot_name}")):
-            os.mkdir(Path(f"/tmp/{self.bot_name}"))
-            os.mkdir(Path(f"/tmp/{self.bot_name}/contexts"))
-        data = update.to_dict()["message"]["from"]
+        with Metrics.timer("context_persistence"):
+            self.save_context(context, update, dispatcher)
+
+    def save_context(self, context, update, dispatcher):
+        data = UpdateView.of(update, dispatcher).user
         if not context.user_data.get(data["id"]):
             context.user_data[data["id"]] = {
                 "id": data["id"],
@@ -85,4 +92,5 @@ class UniHandler(MessageHandler):
                 "payload": {},
             }
 
-        self.update_file_context(context.user_data[data["id"]])
+        self.context_store.save(context.user_data[data["id"]])
+        self.user_registry.touch(context.user_data[data["id"]])
@@ -0,0 +1,89 @@
+import atexit
+import logging
+import os
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from queue import SimpleQueue
+from typing import Dict, Optional
+
+from engine.config import LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_MAX_LENGTH
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    Renders the message on the calling thread, cut to `max_length` characters,
+    and leaves formatting and writing to the listener thread
+    """
+
+    def __init__(self, queue, max_length: int = LOG_MAX_LENGTH):
+        super().__init__(queue)
+        self.max_length = max_length
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        if len(record.msg) > self.max_length:
+            record.msg = f"{record.msg[:self.max_length]}... [{len(record.msg) - self.max_length} more chars]"
+        return record
+
+
+class LogPipeline:
+    """
+    One queue handler on the root logger and one listener thread that writes to stdout
+    and to a rotating `logs/<bot_name>.log` of every bot, attached once per process
+    """
+
+    formatter = logging.Formatter("%(asctime)s %(message)s")
+    queue = SimpleQueue()
+    queue_handler: Optional[TruncatingQueueHandler] = None
+    stream_handler: Optional[logging.Handler] = None
+    file_handlers: Dict[str, RotatingFileHandler] = {}
+    listener: Optional[QueueListener] = None
+    lock = threading.Lock()
+
+    @classmethod
+    def setup(cls, bot_name: str, level: int) -> None:
+        with cls.lock:
+            logger = logging.getLogger()
+            logger.setLevel(level)
+            if cls.queue_handler is None:
+                cls.queue_handler = TruncatingQueueHandler(cls.queue)
+                cls.stream_handler = logging.StreamHandler(sys.stdout)
+                cls.stream_handler.setFormatter(cls.formatter)
+                logger.addHandler(cls.queue_handler)
+                atexit.register(cls.stop)
+            cls.stream_handler.setLevel(level)
+
+            if bot_name not in cls.file_handlers:
+                Path(f"{os.curdir}/logs").mkdir(exist_ok=True)
+                file_handler = RotatingFileHandler(
+                    f"{os.curdir}/logs/{bot_name}.log",
+                    maxBytes=LOG_MAX_BYTES,
+                    backupCount=LOG_BACKUP_COUNT,
+                    encoding="utf8"
+                )
+                file_handler.setFormatter(cls.formatter)
+                cls.file_handlers[bot_name] = file_handler
+            cls.file_handlers[bot_name].setLevel(level)
+            cls.restart()
+
+    @classmethod
+    def restart(cls) -> None:
+        # handlers of a listener are fixed, so a new bot restarts it with its file added
+        if cls.listener is not None:
+            cls.listener.stop()
+        cls.listener = QueueListener(
+            cls.queue,
+            cls.stream_handler,
+            *cls.file_handlers.values(),
+            respect_handler_level=True
+        )
+        cls.listener.start()
+
+    @classmethod
+    def stop(cls) -> None:
+        with cls.lock:
+            if cls.listener is not None:
+                cls.listener.stop()
+                cls.listener = None
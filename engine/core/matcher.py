@@ -0,0 +1,81 @@
+import re
+import threading
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Pattern, Set
+
+REGEX_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+
+class PhraseMatcher:
+    """
+    Phrases of all handlers, compiled once at registration.
+    Literal phrases go into one Aho-Corasick automaton, so a single scan of a message
+    reports every owner with a literal phrase in it; regex phrases are precompiled per owner
+    """
+
+    def __init__(self):
+        self.literals: Dict[str, Set[Hashable]] = {}
+        self.patterns: Dict[Hashable, List[Pattern]] = {}
+        self.lock = threading.Lock()
+        self.goto: List[Dict[str, int]] = []
+        self.fail: List[int] = []
+        self.output: List[frozenset] = []
+        self.built = False
+
+    def add(self, owner: Hashable, phrases: Iterable[str]) -> None:
+        with self.lock:
+            for phrase in phrases:
+                phrase = phrase.lower()
+                if REGEX_CHARS.isdisjoint(phrase):
+                    self.literals.setdefault(phrase, set()).add(owner)
+                else:
+                    self.patterns.setdefault(owner, []).append(re.compile(phrase))
+            self.built = False
+
+    def build(self) -> None:
+        goto, output = [{}], [set()]
+        for phrase, owners in self.literals.items():
+            state = 0
+            for char in phrase:
+                if char not in goto[state]:
+                    goto[state][char] = len(goto)
+                    goto.append({})
+                    output.append(set())
+                state = goto[state][char]
+            output[state] |= owners
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(char, 0)
+                output[child] |= output[fail[child]]
+
+        self.goto, self.fail, self.output = goto, fail, [frozenset(owners) for owners in output]
+        self.built = True
+
+    def scan(self, message: str) -> Set[Hashable]:
+        """Owners with a literal phrase contained in the message"""
+        if not self.built:
+            with self.lock:
+                if not self.built:
+                    self.build()
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set(output[0])
+        state = 0
+        for char in message:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def search(self, owner: Hashable, message: str) -> bool:
+        """Whether one of the regex phrases of the owner matches the message"""
+        return any(pattern.search(message) for pattern in self.patterns.get(owner, ()))
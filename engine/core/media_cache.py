@@ -0,0 +1,174 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from telegram import InputFile, InputMedia, Message
+from telegram.error import BadRequest
+
+FILE_ATTRIBUTES = ("photo", "video", "animation", "audio", "voice", "document")
+
+# BadRequest descriptions that mean a stored file_id is no longer accepted,
+# other errors, like "Chat not found", concern the recipient and keep the file_id
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "invalid file_id", "file reference")
+
+
+class MediaCache:
+    """
+    file_id of every uploaded file, keyed by its path or content hash and persisted to `path`.
+    A file is uploaded once and later sends reference the file_id returned by Telegram
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.file_ids: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.upload_locks: Dict[str, threading.Lock] = {}
+        # keys of file objects, which are read to the end by their first upload
+        self.object_keys = weakref.WeakKeyDictionary()
+        # content of file objects, kept so that the file can be uploaded again after it was read
+        self.input_files = weakref.WeakKeyDictionary()
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.file_ids = json.load(file)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def key(self, media) -> Optional[str]:
+        if isinstance(media, InputMedia):
+            return self.key(media.media)
+        if isinstance(media, str):
+            # any other string is already a file_id
+            return f"url:{media}" if media.startswith(("http://", "https://")) else None
+        if not isinstance(media, InputFile) and not InputFile.is_file(media):
+            return None
+        try:
+            return self.object_keys[media]
+        except (KeyError, TypeError):
+            pass
+        key = self.content_key(media)
+        try:
+            self.object_keys[media] = key
+        except TypeError:
+            pass
+        return key
+
+    def content_key(self, media) -> str:
+        if isinstance(media, InputFile):
+            return "sha256:" + hashlib.sha256(media.input_file_content).hexdigest()
+        name = getattr(media, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            stat = os.stat(name)
+            return f"path:{os.path.abspath(name)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if hasattr(media, "getvalue"):
+            content = media.getvalue()
+        else:
+            with self.lock:
+                position = media.tell()
+                content = media.read()
+                media.seek(position)
+        return "sha256:" + hashlib.sha256(content).hexdigest()
+
+    def prepare(self, media):
+        """Read a file object into an InputFile, which can be uploaded any number of times"""
+        if isinstance(media, (str, InputFile, InputMedia)) or not InputFile.is_file(media):
+            return media
+        try:
+            return self.input_files[media]
+        except (KeyError, TypeError):
+            pass
+        key = self.key(media)
+        with self.lock:
+            input_file = InputFile(media)
+        try:
+            self.input_files[media] = input_file
+        except TypeError:
+            pass
+        if key is not None:
+            self.object_keys[input_file] = key
+        return input_file
+
+    def resolve(self, media, key: Optional[str]):
+        file_id = self.file_ids.get(key) if key else None
+        if file_id is None:
+            return media
+        if isinstance(media, InputMedia):
+            media = copy.copy(media)
+            media.media = file_id
+            return media
+        return file_id
+
+    def remember(self, key: Optional[str], message: Message) -> None:
+        if key is None or key in self.file_ids or not isinstance(message, Message):
+            return
+        for attribute in FILE_ATTRIBUTES:
+            value = getattr(message, attribute, None)
+            if value:
+                # photos come in several sizes, the largest one is the last
+                file_id = value[-1].file_id if isinstance(value, list) else value.file_id
+                break
+        else:
+            return
+        with self.lock:
+            self.file_ids[key] = file_id
+            self.save()
+
+    def forget(self, key: str) -> None:
+        with self.lock:
+            if self.file_ids.pop(key, None) is not None:
+                self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.file_ids, file)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def upload_lock(self, keys: List[Optional[str]]) -> Optional[threading.Lock]:
+        pending = [key for key in keys if key is not None and key not in self.file_ids]
+        if not pending:
+            return None
+        with self.lock:
+            return self.upload_locks.setdefault(pending[0], threading.Lock())
+
+    def send(self, method: Callable, argument: str, media, **kwargs):
+        """Call a `bot.send_*` method with `media` passed as `argument`, uploading it only once"""
+        media = self.prepare(media)
+        key = self.key(media)
+        return self.send_keyed(method, argument, [key], lambda: self.resolve(media, key), kwargs)
+
+    def send_group(self, method: Callable, media: List, **kwargs) -> List[Message]:
+        media = [self.prepare(item) for item in media]
+        keys = [self.key(item) for item in media]
+        return self.send_keyed(
+            method, "media", keys,
+            lambda: [self.resolve(item, key) for item, key in zip(media, keys)],
+            kwargs
+        )
+
+    def send_keyed(self, method: Callable, argument: str, keys: List[Optional[str]], resolve: Callable, kwargs):
+        # concurrent first sends of the same file wait for one upload instead of repeating it
+        lock = self.upload_lock(keys)
+        if lock is None:
+            return self.call(method, argument, keys, resolve, kwargs)
+        with lock:
+            return self.call(method, argument, keys, resolve, kwargs)
+
+    def call(self, method: Callable, argument: str, keys: List[Optional[str]], resolve: Callable, kwargs):
+        cached = [key for key in keys if key in self.file_ids]
+        try:
+            result = method(**{argument: resolve()}, **kwargs)
+        except BadRequest as exc:
+            if not cached or not any(error in exc.message.lower() for error in FILE_ID_ERRORS):
+                raise
+            # a stored file_id was rejected, so the files are uploaded again
+            for key in cached:
+                self.forget(key)
+            result = method(**{argument: resolve()}, **kwargs)
+        for key, message in zip(keys, result if isinstance(result, list) else [result]):
+            self.remember(key, message)
+        return result
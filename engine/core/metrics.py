@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket that holds the quantile"""
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return result
+
+
+class Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        Metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Process-wide latency histograms of pipeline stages, counters and gauges,
+    read through `snapshot` or the Prometheus text endpoint started by `serve`
+    """
+
+    enabled = True
+    stages: Dict[str, Histogram] = {}
+    counters: Dict[Tuple[str, str, str], int] = {}
+    gauges: Dict[str, Callable[[], float]] = {}
+    lock = threading.Lock()
+    server: Optional[ThreadingHTTPServer] = None
+
+    @classmethod
+    def observe(cls, stage: str, seconds: float) -> None:
+        if not cls.enabled:
+            return
+        histogram = cls.stages.get(stage)
+        if histogram is None:
+            with cls.lock:
+                histogram = cls.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    @classmethod
+    def timer(cls, stage: str) -> Timer:
+        return Timer(stage)
+
+    @classmethod
+    def timed(cls, stage: str, func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    @classmethod
+    def increment(cls, name: str, label: str, value: str, amount: int = 1) -> None:
+        if not cls.enabled:
+            return
+        with cls.lock:
+            key = (name, label, value)
+            cls.counters[key] = cls.counters.get(key, 0) + amount
+
+    @classmethod
+    def register_gauge(cls, name: str, func: Callable[[], float]) -> None:
+        cls.gauges[name] = func
+
+    @classmethod
+    def snapshot(cls) -> Dict:
+        stages = {}
+        for stage, histogram in list(cls.stages.items()):
+            with histogram.lock:
+                stages[stage] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+        counters = {}
+        with cls.lock:
+            for (name, label, value), count in cls.counters.items():
+                counters.setdefault(name, {})[value] = count
+        return {
+            "stages": stages,
+            "counters": counters,
+            "gauges": {name: func() for name, func in list(cls.gauges.items())},
+        }
+
+    @classmethod
+    def prometheus(cls) -> str:
+        lines = ["# TYPE uni_stage_seconds histogram"]
+        for stage, histogram in sorted(cls.stages.items()):
+            with histogram.lock:
+                for bound, count in histogram.cumulative():
+                    lines.append(f'uni_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'uni_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'uni_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        with cls.lock:
+            counters = sorted(cls.counters.items())
+        names = set()
+        for (name, label, value), count in counters:
+            if name not in names:
+                lines.append(f"# TYPE {name} counter")
+                names.add(name)
+            lines.append(f'{name}{{{label}="{value}"}} {count}')
+        for name, func in sorted(cls.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def serve(cls, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        if cls.server is not None:
+            return cls.server
+        cls.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, name="Metrics", daemon=True).start()
+        return cls.server
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls.lock:
+            cls.stages = {}
+            cls.counters = {}
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = Metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
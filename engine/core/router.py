@@ -0,0 +1,53 @@
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Handler, Dispatcher
+
+from engine.core.handler import UniHandler
+
+
+class UniRouter(Handler):
+    """
+    Single dispatcher entry for all UniHandlers.
+    Handlers are grouped by state when the bot starts, so an update is checked
+    only against the handlers allowed in the current state of its user, in priority order
+    """
+
+    def __init__(self, handlers: List[UniHandler], dispatcher: Dispatcher):
+        super().__init__(callback=None)
+        self.dispatcher = dispatcher
+        self.any_state = [handler for handler in handlers if not self.handler_states(handler)]
+        self.by_state: Dict[str, List[UniHandler]] = {}
+        for handler in handlers:
+            for state in self.handler_states(handler):
+                self.by_state[state] = [
+                    candidate for candidate in handlers
+                    if not self.handler_states(candidate) or state in self.handler_states(candidate)
+                ]
+
+    @staticmethod
+    def handler_states(handler: UniHandler) -> List[str]:
+        # payment handlers use a stock filter that ignores the state
+        if handler.successful_payment:
+            return []
+        return handler.filter.state or []
+
+    def candidates(self, update: Update) -> List[UniHandler]:
+        user = update.effective_user
+        if user is None:
+            return self.any_state
+        context = self.dispatcher.user_data[user.id].get(user.id)
+        return self.by_state.get(context["state"] if context else '', self.any_state)
+
+    def check_update(self, update) -> Optional[Tuple[UniHandler, object]]:
+        if not isinstance(update, Update):
+            return None
+        for handler in self.candidates(update):
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return handler, check
+        return None
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        handler, check = check_result
+        return handler.handle_update(update, dispatcher, check, context)
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from telegram.error import RetryAfter, TimedOut
+
+from engine.core.executor import ShardedExecutor
+from engine.core.metrics import Metrics
+
+
+class SendQueue:
+    """
+    Outbound Bot API calls queued by chat: calls to one chat are made in order by one worker,
+    different chats are served in parallel. RetryAfter and timeouts are retried by the worker,
+    other errors are logged since the handler that queued the call has already returned.
+    A retry is scheduled on a timer instead of sleeping on the worker, later calls to the chat
+    are held until it is made, so other chats of the worker are not delayed
+    """
+
+    def __init__(self, workers: int, queue_size: int = 0, max_retries: int = 3):
+        self.executor = ShardedExecutor(workers, queue_size, name="Send")
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.scheduled_done = threading.Condition(self.lock)
+        self.held: Dict[Hashable, Deque[Tuple]] = {}
+        self.scheduled = 0
+        self.logger = logging.getLogger()
+
+    def submit(self, chat_id: Hashable, func: Callable, args: tuple = (), kwargs: Optional[dict] = None) -> None:
+        self.executor.submit(chat_id, self.run, chat_id, (time.perf_counter(), func, args, kwargs or {}, 0), False)
+
+    def run(self, chat_id: Hashable, call: Tuple, retried: bool) -> None:
+        with self.lock:
+            if not retried and chat_id in self.held:
+                # an earlier call to the chat waits for its retry
+                self.held[chat_id].append(call)
+                return
+        if self.attempt(chat_id, call) or not retried:
+            return
+        # the retried call is done, calls held behind it are made in order
+        while True:
+            with self.lock:
+                if not self.held[chat_id]:
+                    del self.held[chat_id]
+                    return
+                call = self.held[chat_id].popleft()
+            if self.attempt(chat_id, call):
+                return
+
+    def attempt(self, chat_id: Hashable, call: Tuple) -> bool:
+        """Make the call, True if it was scheduled to be retried"""
+        queued, func, args, kwargs, attempt = call
+        if not attempt:
+            Metrics.observe("send_queue_wait", time.perf_counter() - queued)
+        try:
+            with Metrics.timer("send"):
+                func(*args, **kwargs)
+        except RetryAfter as exc:
+            return self.retry(chat_id, call, exc.retry_after, exc)
+        except TimedOut as exc:
+            return self.retry(chat_id, call, 2 ** attempt, exc)
+        except Exception as exc:
+            self.fail(func, exc)
+            return False
+        with self.lock:
+            self.sent += 1
+        return False
+
+    def retry(self, chat_id: Hashable, call: Tuple, delay: float, exc: Exception) -> bool:
+        queued, func, args, kwargs, attempt = call
+        if attempt == self.max_retries:
+            self.fail(func, exc)
+            return False
+        with self.lock:
+            self.held.setdefault(chat_id, deque())
+            self.scheduled += 1
+        timer = threading.Timer(delay, self.resubmit, (chat_id, (queued, func, args, kwargs, attempt + 1)))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def resubmit(self, chat_id: Hashable, call: Tuple) -> None:
+        self.executor.submit(chat_id, self.run, chat_id, call, True)
+        with self.lock:
+            self.scheduled -= 1
+            self.scheduled_done.notify_all()
+
+    def fail(self, func: Callable, exc: Exception) -> None:
+        with self.lock:
+            self.failed += 1
+        self.logger.warning(f'Queued {getattr(func, "__name__", func)} caused error {exc}')
+
+    def depth(self) -> int:
+        return self.executor.depth()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queue_depth": self.depth(), "sent": self.sent, "failed": self.failed}
+
+    def join(self) -> None:
+        """Wait until every queued call is made, retries included"""
+        while True:
+            self.executor.join()
+            with self.lock:
+                if not self.scheduled and not self.held:
+                    return
+                self.scheduled_done.wait(0.1)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
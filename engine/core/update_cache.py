@@ -0,0 +1,29 @@
+from typing import Any, Dict
+
+from telegram import Update
+
+from engine.core.metrics import Metrics
+
+
+class UpdateCache:
+    """
+    Storage for values computed once per update and shared by all handlers
+    """
+
+    storage: Dict[int, Dict[str, Any]] = {}
+
+    @classmethod
+    def get(cls, update: Update) -> Dict[str, Any]:
+        return cls.storage.setdefault(id(update), {})
+
+    @classmethod
+    def release(cls, update: Update) -> None:
+        cls.storage.pop(id(update), None)
+
+    @classmethod
+    def message_vector(cls, update: Update, message: str, vectorizer):
+        vectors = cls.get(update).setdefault("message_vectors", {})
+        if message not in vectors:
+            with Metrics.timer("encode"):
+                vectors[message] = vectorizer.encode([message])
+        return vectors[message]
@@ -0,0 +1,83 @@
+from typing import Dict, Optional
+
+from telegram import Update, Message
+from telegram.ext import CallbackContext, Dispatcher
+
+from engine.core.update_cache import UpdateCache
+
+
+class UpdateView:
+    """
+    Parsed form of an update, computed once and shared by all filters and handlers
+    """
+
+    def __init__(self, update: Update, dispatcher: Dispatcher):
+        self.update = update
+        self.dispatcher = dispatcher
+        self._context = None
+        self._user = None
+        self._dict = None
+        self._parsed_message = False
+        self._text = None
+        self._has_media = False
+
+    @classmethod
+    def of(cls, update: Update, dispatcher: Dispatcher) -> "UpdateView":
+        cache = UpdateCache.get(update)
+        if "view" not in cache:
+            cache["view"] = cls(update, dispatcher)
+        return cache["view"]
+
+    @property
+    def context(self) -> CallbackContext:
+        if self._context is None:
+            self._context = CallbackContext.from_update(self.update, self.dispatcher)
+        return self._context
+
+    @property
+    def user_id(self) -> int:
+        return self.update.effective_user.id
+
+    @property
+    def user(self) -> Dict:
+        if self._user is None:
+            self._user = self.update.effective_user.to_dict()
+        return self._user
+
+    @property
+    def text(self) -> Optional[str]:
+        """Lowercased caption or text of the message"""
+        self.parse_message()
+        return self._text
+
+    @property
+    def has_media(self) -> bool:
+        self.parse_message()
+        return self._has_media
+
+    @property
+    def dict(self) -> Dict:
+        if self._dict is None:
+            self._dict = self.update.to_dict()
+        return self._dict
+
+    def parse_message(self) -> None:
+        if self._parsed_message:
+            return
+        message = self.update.message
+        if getattr(message, "caption", None):
+            self._text = message.caption.lower()
+        elif getattr(message, "text", None):
+            self._text = message.text.lower()
+        else:
+            self._text = None
+        self._has_media = message is not None and any(
+            getattr(message, attr, None) for attr in ("document", "photo", "audio", "voice", "video")
+        )
+        self._parsed_message = True
+
+    def set_message(self, message: Message) -> None:
+        """Replace the message of the update, values derived from it are computed again"""
+        self.update.message = message
+        self._dict = None
+        self._parsed_message = False
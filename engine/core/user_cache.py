@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, MutableMapping, Optional
+
+from engine.core.context_store import ContextStore
+
+
+class UserDataCache(MutableMapping):
+    """
+    Bounded replacement of `dispatcher.user_data`.
+    Least recently used users, and users idle for longer than `ttl` seconds, are evicted
+    to the context store and loaded back from it the next time they are accessed
+    """
+
+    def __init__(self, context_store: ContextStore, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.context_store = context_store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data: "OrderedDict[int, dict]" = OrderedDict()
+        self.accessed: Dict[int, float] = {}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, user_id: int) -> dict:
+        with self.lock:
+            if user_id in self.data:
+                self.hits += 1
+                self.touch(user_id)
+                value = self.data[user_id]
+                self.evict()
+                return value
+            self.misses += 1
+            # a context is stored as user_data[id][id], like the handlers keep it
+            context = self.context_store.load(user_id)
+            value = {user_id: context} if context is not None else {}
+            self[user_id] = value
+            return value
+
+    def __setitem__(self, user_id: int, value: dict) -> None:
+        with self.lock:
+            self.data[user_id] = value
+            self.touch(user_id)
+            self.evict()
+
+    def __delitem__(self, user_id: int) -> None:
+        with self.lock:
+            del self.data[user_id]
+            del self.accessed[user_id]
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.data
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self.data))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, user_id: int, default=None):
+        with self.lock:
+            return self[user_id] if user_id in self.data else default
+
+    def touch(self, user_id: int) -> None:
+        self.data.move_to_end(user_id)
+        self.accessed[user_id] = time.monotonic()
+
+    def evict(self) -> None:
+        deadline = time.monotonic() - self.ttl if self.ttl is not None else None
+        while self.data:
+            user_id = next(iter(self.data))
+            if not (self.max_size is not None and len(self.data) > self.max_size
+                    or deadline is not None and self.accessed[user_id] < deadline):
+                break
+            value = self.data.pop(user_id)
+            del self.accessed[user_id]
+            if value.get(user_id):
+                self.context_store.save(value[user_id])
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
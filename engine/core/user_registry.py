@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from engine.core.context_store import ContextStore
+from engine.core.flusher import PeriodicFlusher
+from engine.core.metrics import Metrics
+
+
+class UserRegistry(PeriodicFlusher):
+    """
+    Every user the bot has seen, with state and first/last seen times, in an indexed SQLite table.
+    Users are touched on each update and written in batches by `flush`, like contexts,
+    and `iter_ids` streams a segment of users in chunks of ids
+    """
+
+    flushed = "the user registry"
+
+    def __init__(self, path: str):
+        super().__init__()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INTEGER PRIMARY KEY, state TEXT NOT NULL DEFAULT '', first_seen REAL, last_seen REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS users_state ON users (state, id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS users_last_seen ON users (last_seen)")
+        self.connection.commit()
+        # contexts are kept by reference, so the state set by the callback is the one written
+        self.pending: Dict[int, Tuple[dict, Optional[float]]] = {}
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+
+    def touch(self, context: dict) -> None:
+        with self.lock:
+            self.pending[context["id"]] = (context, time.time())
+
+    def flush(self) -> None:
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        rows = [(user_id, context.get("state") or '', seen, seen) for user_id, (context, seen) in batch.items()]
+        with self.io_lock, Metrics.timer("registry_flush"), self.connection:
+            self.connection.executemany(
+                "INSERT INTO users (id, state, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET state = excluded.state, last_seen = excluded.last_seen",
+                rows
+            )
+
+    def migrate(self, context_store: ContextStore) -> int:
+        """Register the users of a context store once, when the registry is still empty"""
+        with self.io_lock:
+            if self.connection.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+                return 0
+        count = 0
+        for user_id in context_store.user_ids():
+            context = context_store.load(user_id)
+            if context is not None:
+                with self.lock:
+                    self.pending.setdefault(user_id, (context, None))
+                count += 1
+                if count % 10000 == 0:
+                    self.flush()
+        self.flush()
+        return count
+
+    def iter_ids(
+            self,
+            state: Optional[Union[str, List[str]]] = None,
+            seen_after: Optional[float] = None,
+            seen_before: Optional[float] = None,
+            chunk_size: int = 1000,
+    ) -> Iterator[int]:
+        """
+        Ids of users in `state` (one or a list) last seen within the given unix times, in id order.
+        Each chunk is a separate query that starts after the last id, so the table is not locked
+        while the ids are consumed
+        """
+        conditions, parameters = self.conditions(state, seen_after, seen_before)
+        self.flush()
+        last_id = None
+        while True:
+            where = conditions + (["id > ?"] if last_id is not None else [])
+            query = "SELECT id FROM users" + (f" WHERE {' AND '.join(where)}" if where else "")
+            with self.io_lock:
+                rows = self.connection.execute(
+                    f"{query} ORDER BY id LIMIT ?",
+                    parameters + ([last_id] if last_id is not None else []) + [chunk_size]
+                ).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    def count(
+            self,
+            state: Optional[Union[str, List[str]]] = None,
+            seen_after: Optional[float] = None,
+            seen_before: Optional[float] = None,
+    ) -> int:
+        conditions, parameters = self.conditions(state, seen_after, seen_before)
+        self.flush()
+        query = "SELECT COUNT(*) FROM users" + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+        with self.io_lock:
+            return self.connection.execute(query, parameters).fetchone()[0]
+
+    @staticmethod
+    def conditions(state, seen_after, seen_before) -> Tuple[List[str], list]:
+        conditions, parameters = [], []
+        if state is not None:
+            states = [state] if isinstance(state, str) else list(state)
+            conditions.append(f"state IN ({', '.join('?' * len(states))})")
+            parameters += states
+        if seen_after is not None:
+            conditions.append("last_seen >= ?")
+            parameters.append(seen_after)
+        if seen_before is not None:
+            conditions.append("last_seen < ?")
+            parameters.append(seen_before)
+        return conditions, parameters
+
+    def close(self) -> None:
+        if self.stop_event.is_set():
+            return
+        super().close()
+        with self.io_lock:
+            self.connection.close()
@@ -0,0 +1,165 @@
+"""
+Webhook ingress of TelegramBot, and a stand-in for Telegram that posts recorded updates to it.
+
+    python -m engine.core.webhook updates.jsonl --url http://127.0.0.1:8443/webhook --concurrency 8
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+
+from telegram import Update
+
+from engine.core.metrics import Metrics
+
+OVERFLOW_POLICIES = ("block", "shed")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Accepts updates posted by Telegram and queues them on the update executor of the bot.
+    When the queue is full the request waits for up to `block_timeout` seconds ("block")
+    or is refused at once ("shed"), a refused update gets 429 and is sent again by Telegram
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+            self,
+            bot,
+            listen: str,
+            port: int,
+            url_path: str,
+            overflow: str = "block",
+            block_timeout: float = 5.0,
+            record_path: Optional[str] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise Exception(f"Unknown overflow policy {overflow}, expected one of {OVERFLOW_POLICIES}")
+        self.bot = bot
+        self.url_path = "/" + url_path.lstrip("/")
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.accepted = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+        self.record = open(record_path, "a", encoding="utf-8", buffering=1) if record_path else None
+        super().__init__((listen, port), WebhookRequestHandler)
+
+    def submit(self, body: bytes) -> bool:
+        data = json.loads(body)
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            raise ValueError("The body is not an update")
+        update = Update.de_json(data, self.bot.bot)
+        user = update.effective_user or update.effective_chat
+        accepted = self.bot.update_executor.submit(
+            user.id if user else update.update_id,
+            self.bot.run_update,
+            update,
+            block=self.overflow == "block",
+            timeout=self.block_timeout,
+        )
+        with self.lock:
+            if accepted:
+                self.accepted += 1
+                if self.record:
+                    self.record.write(body.decode("utf-8") + "\n")
+            else:
+                self.refused += 1
+        Metrics.increment("uni_webhook_updates_total", "result", "accepted" if accepted else "refused")
+        return accepted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.bot.update_executor.depth(),
+            "accepted": self.accepted,
+            "refused": self.refused,
+        }
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.record:
+            self.record.close()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split("?")[0] != self.server.url_path:
+            self.reply(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            accepted = self.server.submit(body)
+        except (ValueError, TypeError, AttributeError, KeyError):
+            # malformed json, or json that is not an update
+            self.reply(400)
+            return
+        if accepted:
+            self.reply(200)
+        else:
+            self.reply(429, {"Retry-After": "1"})
+
+    def do_GET(self):
+        if self.path.split("?")[0] != self.server.url_path:
+            self.reply(404)
+            return
+        self.reply(200, body=json.dumps(self.server.stats()).encode("utf-8"))
+
+    def reply(self, status: int, headers: Optional[Dict[str, str]] = None, body: bytes = b"") -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def replay(url: str, updates: Iterable[bytes], concurrency: int = 8, retries: int = 10) -> Dict[str, float]:
+    """Post recorded updates like Telegram does, an update refused with 429 is posted again"""
+    statuses: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def post(body: bytes) -> None:
+        for _ in range(retries + 1):
+            request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status = response.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if status != 429:
+                return
+            time.sleep(1)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        count = sum(1 for _ in pool.map(post, updates))
+    elapsed = time.perf_counter() - start
+    return {"updates": count, "seconds": elapsed, "updates_per_second": count / elapsed, "statuses": statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="file with one update json per line")
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.updates, "rb") as file:
+        updates = [line.strip() for line in file if line.strip()]
+    print(json.dumps(replay(args.url, updates, args.concurrency), indent=2))
+
+
+if __name__ == "__main__":
+    main()
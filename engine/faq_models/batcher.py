@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+from typing import List, Tuple
+
+import numpy as np
+
+
+class BatchingEncoder:
+    """
+    Front-end of a sentence encoder that merges concurrent `encode` calls
+    into one batched forward pass
+    """
+
+    def __init__(self, model, window: float, max_batch_size: int):
+        self.model = model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.requests: "Queue[Tuple[List[str], Future]]" = Queue()
+        self.thread = threading.Thread(target=self.run, name="BatchingEncoder", daemon=True)
+        self.thread.start()
+
+    def encode(self, sentences: List[str], **kwargs) -> np.ndarray:
+        # large batches, e.g. FAQ phrases at startup, gain nothing from waiting
+        if kwargs or not sentences or len(sentences) >= self.max_batch_size:
+            return np.asarray(self.model.encode(sentences, **kwargs))
+        future = Future()
+        self.requests.put((list(sentences), future))
+        return future.result()
+
+    def run(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self.process(batch)
+
+    def process(self, batch: List[Tuple[List[str], Future]]) -> None:
+        try:
+            vectors = np.asarray(self.model.encode([
+                sentence for sentences, _ in batch for sentence in sentences
+            ]))
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        start = 0
+        for sentences, future in batch:
+            future.set_result(vectors[start:start + len(sentences)])
+            start += len(sentences)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from engine.faq_models.index import FaqIndex, normalize
+
+
+class EmbeddingCache:
+    """
+    Sidecar cache of normalized FAQ phrase vectors.
+    Vectors are stored as `.npy` next to the FAQ file and memory-mapped on load,
+    so an unchanged FAQ is not encoded again and its pages are shared between processes
+    """
+
+    directory = ".faq_cache"
+
+    def __init__(self, faq_json_path: str, model_name: str):
+        self.faq_json_path = Path(faq_json_path)
+        self.cache_dir = self.faq_json_path.parent / self.directory
+        self.model_name = model_name
+        self.prefix = f"{self.faq_json_path.name}.{model_name.replace('/', '_')}."
+
+    def load(self, faq_dict: Dict, content: bytes, vectorizer) -> np.ndarray:
+        phrases = FaqIndex.phrases(faq_dict)
+        if not phrases:
+            return np.empty((0, 0), dtype=np.float32)
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        matrix_path = self.cache_dir / f"{self.prefix}{digest}.npy"
+        manifest_path = self.cache_dir / f"{self.prefix}{digest}.json"
+
+        if self.read_manifest(manifest_path) == phrases:
+            try:
+                return np.load(str(matrix_path), mmap_mode="r")
+            except (OSError, ValueError):
+                pass
+
+        matrix = self.build(phrases, vectorizer)
+        try:
+            self.cache_dir.mkdir(exist_ok=True)
+            self.write(matrix_path, manifest_path, matrix, {
+                "faq_hash": digest,
+                "model_name": self.model_name,
+                "phrases": phrases,
+            })
+            self.remove_stale(digest)
+            return np.load(str(matrix_path), mmap_mode="r")
+        except OSError:
+            return matrix
+
+    def build(self, phrases: List[str], vectorizer) -> np.ndarray:
+        known = self.previous_vectors()
+        new_phrases = list(dict.fromkeys(phrase for phrase in phrases if phrase not in known))
+        if new_phrases:
+            known.update(zip(new_phrases, normalize(vectorizer.encode(new_phrases))))
+        return np.ascontiguousarray([known[phrase] for phrase in phrases], dtype=np.float32)
+
+    def previous_vectors(self) -> Dict[str, np.ndarray]:
+        manifests = sorted(
+            self.cache_dir.glob(f"{self.prefix}*.json"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        ) if self.cache_dir.exists() else []
+        for manifest_path in manifests:
+            phrases = self.read_manifest(manifest_path)
+            try:
+                matrix = np.load(str(manifest_path.with_suffix(".npy")), mmap_mode="r")
+            except (OSError, ValueError):
+                continue
+            if phrases is not None and len(phrases) == len(matrix):
+                return dict(zip(phrases, matrix))
+        return {}
+
+    @staticmethod
+    def read_manifest(manifest_path: Path) -> Optional[List[str]]:
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                return json.load(file)["phrases"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def write(matrix_path: Path, manifest_path: Path, matrix: np.ndarray, manifest: Dict) -> None:
+        # the manifest is written last, so a reader never sees it without a complete matrix
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(str(matrix_path) + tmp_suffix, "wb") as file:
+            np.save(file, matrix)
+        os.replace(str(matrix_path) + tmp_suffix, matrix_path)
+        with open(str(manifest_path) + tmp_suffix, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False)
+        os.replace(str(manifest_path) + tmp_suffix, manifest_path)
+
+    def remove_stale(self, digest: str) -> None:
+        for path in self.cache_dir.glob(f"{self.prefix}*"):
+            if not path.name.startswith(f"{self.prefix}{digest}.") and path.suffix != ".tmp":
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
@@ -0,0 +1,218 @@
+import copy
+import hashlib
+import itertools
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from engine.config import FAQ_TOP_K
+from engine.faq_models.search import SearchBackend, make_backend
+from engine.faq_models.vectorizer import Vectorizer
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2, order="C")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors /= norms
+    return vectors
+
+
+class FaqIndex:
+    """
+    FAQ phrase vectors stored as one normalized matrix.
+    With `dtype` float16 or int8 (scalar-quantized with a scale per row)
+    the matrix is kept in the compact form and scored chunk by chunk
+    """
+
+    storage: Dict[Tuple, "FaqIndex"] = {}
+    storage_lock = threading.Lock()
+    backend_serials = itertools.count()
+    reload_lock = threading.Lock()
+    chunk_size = 4096
+
+    def __init__(
+            self,
+            faq_dict: Dict,
+            matrix: np.ndarray,
+            backend: Optional[SearchBackend] = None,
+            dtype: str = "float32",
+            version: Optional[str] = None,
+    ):
+        if dtype not in DTYPES:
+            raise Exception(f"Unknown FAQ vectors dtype {dtype}, expected one of {list(DTYPES)}")
+        self.faq_dict = faq_dict
+        # intents without phrases can never be matched, so they get no rows
+        self.keys = [key for key in faq_dict.keys() if faq_dict[key]["phrases"]]
+        counts = [len(faq_dict[key]["phrases"]) for key in self.keys]
+        self.offsets = np.cumsum([0] + counts[:-1]).astype(np.intp)
+        if len(matrix) != sum(counts):
+            raise Exception("FAQ matrix does not match the number of phrases")
+        self.dtype = dtype
+        self.scales = None
+        if dtype == "float16":
+            matrix = matrix.astype(np.float16)
+        elif dtype == "int8":
+            self.scales = np.asarray(np.abs(matrix).max(axis=1, initial=0) / 127, dtype=np.float32)
+            self.scales[self.scales == 0] = 1
+            matrix = np.round(matrix / self.scales[:, None]).astype(np.int8)
+        self.matrix = matrix
+        self.backend = backend
+        if self.backend is not None and self.keys:
+            self.backend.build(self)
+        # search results are cached under the version, it changes with the FAQ and the scoring options
+        if version is None:
+            version = hashlib.sha256(json.dumps(faq_dict, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        self.digest = version
+        # backends of one type differ in their options (n_probe, ef), so each one gets its own version
+        search = f"{type(backend).__name__}.{next(self.backend_serials)}" if backend is not None else "exact"
+        self.version = f"{version}.{dtype}.{search}"
+        # key in `storage` of a loaded index, a reload puts the new index under it
+        self.key: Optional[Tuple] = None
+
+    @classmethod
+    def load(
+            cls,
+            faq_json_path: str,
+            dtype: str = "float32",
+            backend: Union[str, SearchBackend, None] = None,
+    ) -> "FaqIndex":
+        """Index of a FAQ file, shared by every handler with the same file and options"""
+        backend_key = id(backend) if isinstance(backend, SearchBackend) else backend
+        key = (str(Path(faq_json_path).resolve()), dtype, backend_key)
+        with cls.storage_lock:
+            if key not in cls.storage:
+                with open(key[0], "rb") as f:
+                    content = f.read()
+                cls.storage[key] = cls.build(key, content, make_backend(backend))
+            return cls.storage[key]
+
+    @classmethod
+    def build(cls, key: Tuple, content: bytes, backend: Optional[SearchBackend]) -> "FaqIndex":
+        from engine.faq_models.cache import EmbeddingCache
+
+        faq_dict = json.loads(content)
+        # phrases cached for the previous content of the file are not encoded again
+        matrix = EmbeddingCache(key[0], Vectorizer.model_name).load(faq_dict, content, Vectorizer.get_model())
+        index = cls(faq_dict, matrix, backend, key[1], hashlib.sha256(content).hexdigest()[:16])
+        index.key = key
+        return index
+
+    @classmethod
+    def reload(cls, faq_json_path: Optional[str] = None) -> List[Tuple["FaqIndex", "FaqIndex"]]:
+        """
+        Rebuild the loaded indexes of a FAQ file (of every file by default) whose content has changed
+        and return the (old, new) pairs. A new index is built aside and swapped in complete,
+        handlers search the old one until then
+        """
+        path = str(Path(faq_json_path).resolve()) if faq_json_path is not None else None
+        replaced = []
+        with cls.reload_lock:
+            for key, current in list(cls.storage.items()):
+                if path is not None and key[0] != path:
+                    continue
+                with open(key[0], "rb") as f:
+                    content = f.read()
+                if hashlib.sha256(content).hexdigest()[:16] == current.digest:
+                    continue
+                # the backend of the old index keeps serving searches, the new one is built on a copy
+                index = cls.build(key, content, copy.copy(current.backend))
+                with cls.storage_lock:
+                    cls.storage[key] = index
+                replaced.append((current, index))
+        return replaced
+
+    @classmethod
+    def paths(cls) -> List[str]:
+        with cls.storage_lock:
+            return list(dict.fromkeys(key[0] for key in cls.storage))
+
+    @classmethod
+    def from_faq(
+            cls,
+            faq_dict: Dict,
+            vectorizer,
+            backend: Optional[SearchBackend] = None,
+            dtype: str = "float32",
+    ) -> "FaqIndex":
+        phrases = cls.phrases(faq_dict)
+        matrix = normalize(vectorizer.encode(phrases)) if phrases else np.empty((0, 0), np.float32)
+        return cls(faq_dict, matrix, backend, dtype)
+
+    @staticmethod
+    def phrases(faq_dict: Dict) -> List[str]:
+        return [phrase for key in faq_dict.keys() for phrase in faq_dict[key]["phrases"]]
+
+    def vectors(self) -> np.ndarray:
+        vectors = np.asarray(self.matrix, dtype=np.float32)
+        return vectors * self.scales[:, None] if self.scales is not None else vectors
+
+    def row_scores(self, vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.dtype == "float32":
+            return matrix @ vector
+        # compact rows are widened a chunk at a time, never the whole matrix
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.chunk_size):
+            scores[start:start + self.chunk_size] = \
+                matrix[start:start + self.chunk_size].astype(np.float32) @ vector
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def scores(self, message_vector) -> np.ndarray:
+        if not self.keys:
+            return np.empty(0, dtype=np.float32)
+        phrase_scores = self.row_scores(normalize(message_vector)[0])
+        return np.maximum.reduceat(phrase_scores, self.offsets)
+
+    def top_k(self, message_vector, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best `k` intents as positions in `keys` and their scores, best first"""
+        if not self.keys:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        if self.backend is None:
+            scores = self.scores(message_vector)
+            intents = np.argsort(-scores, kind="stable")[:k]
+            return intents, scores[intents]
+        # an intent owns several phrases, so more rows than intents are requested,
+        # and more again while the best rows belong to fewer than `k` intents
+        vector = normalize(message_vector)[0]
+        count = min(len(self.matrix), k * -(-len(self.matrix) // len(self.keys)))
+        while True:
+            rows, row_scores = self.backend.query(vector, count)
+            intents = np.searchsorted(self.offsets, rows, side="right") - 1
+            # rows come best first, so the first row of an intent carries its maximum
+            intents, first = np.unique(intents, return_index=True)
+            if len(intents) >= min(k, len(self.keys)) or count >= len(self.matrix):
+                break
+            count = min(len(self.matrix), count * 2)
+        order = np.argsort(first, kind="stable")[:k]
+        return intents[order], row_scores[first[order]]
+
+    def search(
+            self,
+            message_vector,
+            similarity_score: float,
+            top_k: Optional[int] = None
+    ) -> List[Tuple[str, Dict, float]]:
+        if self.backend is None and top_k is None:
+            scores = self.scores(message_vector)
+            intents = np.flatnonzero(scores > similarity_score)
+            intents = intents[np.argsort(-scores[intents], kind="stable")]
+            scores = scores[intents]
+        else:
+            intents, scores = self.top_k(message_vector, top_k or FAQ_TOP_K)
+            intents, scores = intents[scores > similarity_score], scores[scores > similarity_score]
+        return [
+            (self.keys[intent], {
+                "phrases": self.faq_dict[self.keys[intent]]["phrases"],
+                "answer": self.faq_dict[self.keys[intent]]["answer"],
+                "metadata": self.faq_dict[self.keys[intent]]["metadata"]
+            }, float(score))
+            for intent, score in zip(intents, scores)
+        ]
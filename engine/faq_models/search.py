@@ -0,0 +1,134 @@
+from typing import Dict, Optional, Tuple, Type, Union
+
+import numpy as np
+
+
+class SearchBackend:
+    """
+    Interface of FAQ phrase search backends.
+    `build` receives a FaqIndex, `query` returns phrase rows and their scores, best first
+    """
+
+    def build(self, index) -> None:
+        raise NotImplementedError
+
+    def query(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+def top_rows(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if k < len(scores):
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
+
+
+class ExactSearch(SearchBackend):
+    """
+    Exhaustive search, the reference for approximate backends
+    """
+
+    def build(self, index) -> None:
+        self.index = index
+
+    def query(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.index.row_scores(vector)
+        return top_rows(np.arange(len(scores)), scores, k)
+
+
+class IvfSearch(SearchBackend):
+    """
+    Inverted file index: phrases are partitioned by spherical k-means
+    and only the `n_probe` partitions closest to the query are scored
+    """
+
+    def __init__(
+            self,
+            n_lists: Optional[int] = None,
+            n_probe: int = 8,
+            iterations: int = 10,
+            train_size: int = 256,
+            seed: int = 0,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.train_size = train_size
+        self.seed = seed
+
+    def build(self, index) -> None:
+        self.index = index
+        vectors = index.vectors()
+        n_lists = min(self.n_lists or max(int(np.sqrt(len(vectors))), 1), len(vectors))
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if len(vectors) > n_lists * self.train_size:
+            sample = vectors[rng.choice(len(vectors), n_lists * self.train_size, replace=False)]
+
+        self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self.assign(sample)
+            for i in range(n_lists):
+                members = sample[assignment == i]
+                centroid = members.sum(axis=0) if len(members) else sample[rng.integers(len(sample))]
+                self.centroids[i] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assignment = self.assign(vectors)
+        self.rows = np.argsort(assignment, kind="stable")
+        self.list_offsets = np.searchsorted(assignment[self.rows], np.arange(n_lists + 1))
+
+    def assign(self, vectors: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[start:start + chunk_size] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk_size)
+        ]) if len(vectors) else np.empty(0, dtype=np.intp)
+
+    def query(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        centroid_scores = self.centroids @ vector
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        rows = np.concatenate([
+            self.rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in probes
+        ])
+        return top_rows(rows, self.index.row_scores(vector, rows), k)
+
+
+class HnswSearch(SearchBackend):
+    """
+    Graph search backed by the optional hnswlib package
+    """
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef: int = 64):
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+
+    def build(self, index) -> None:
+        import hnswlib
+
+        vectors = index.vectors()
+        self.graph = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        self.graph.init_index(max_elements=len(vectors), ef_construction=self.ef_construction, M=self.m)
+        self.graph.add_items(vectors, np.arange(len(vectors)))
+        self.graph.set_ef(self.ef)
+
+    def query(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        labels, distances = self.graph.knn_query(vector, k=min(k, self.graph.get_current_count()))
+        # inner product space reports 1 - similarity as the distance
+        return labels[0].astype(np.intp), 1 - distances[0]
+
+
+BACKENDS: Dict[str, Type[SearchBackend]] = {
+    "exact": ExactSearch,
+    "ivf": IvfSearch,
+    "hnsw": HnswSearch,
+}
+
+
+def make_backend(backend: Union[str, SearchBackend, None]) -> Optional[SearchBackend]:
+    if backend is None or isinstance(backend, SearchBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown FAQ search backend {backend}, expected one of {list(BACKENDS)}")
+    return BACKENDS[backend]()
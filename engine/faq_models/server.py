@@ -0,0 +1,149 @@
+"""
+Embedding server: one process owns the sentence encoder and bots on the same host
+get vectors from it over a Unix socket.
+
+    python -m engine.faq_models.server --socket /tmp/embeddings.sock
+
+and in every bot process, before the handlers are registered:
+
+    Vectorizer.connect("/tmp/embeddings.sock")
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from engine.config import EMBEDDING_CHUNK_SIZE, ENCODE_BATCH_SIZE
+
+# request: payload length and a json list of sentences
+# response: status, rows and dimension, followed by float32 vectors or an utf-8 error message
+REQUEST_HEADER = struct.Struct(">I")
+RESPONSE_HEADER = struct.Struct(">BII")
+
+
+def read_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        chunk = sock.recv_into(view[received:])
+        if not chunk:
+            raise ConnectionError("Embedding server closed the connection")
+        received += chunk
+    return bytes(buffer)
+
+
+class EmbeddingRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        while True:
+            header = self.rfile.read(REQUEST_HEADER.size)
+            if len(header) < REQUEST_HEADER.size:
+                return
+            sentences = json.loads(self.rfile.read(REQUEST_HEADER.unpack(header)[0]))
+            try:
+                vectors = np.asarray(self.server.model.encode(sentences), dtype=np.float32).reshape(len(sentences), -1)
+            except Exception as exc:
+                message = str(exc).encode("utf-8")
+                self.wfile.write(RESPONSE_HEADER.pack(1, len(message), 0) + message)
+                continue
+            self.wfile.write(RESPONSE_HEADER.pack(0, *vectors.shape) + vectors.tobytes())
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves `model.encode` to other processes, one thread per connection
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, socket_path: str, model):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.model = model
+        super().__init__(socket_path, EmbeddingRequestHandler)
+
+
+class EmbeddingClient:
+    """
+    Drop-in replacement of the model that encodes sentences in the embedding server.
+    Every thread keeps its own connection, large inputs are sent in requests of `chunk_size`
+    sentences so that each one is answered within `timeout`
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = 30, chunk_size: int = EMBEDDING_CHUNK_SIZE):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.local = threading.local()
+
+    def connection(self) -> socket.socket:
+        if getattr(self.local, "sock", None) is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return self.local.sock
+
+    def close(self) -> None:
+        if getattr(self.local, "sock", None) is not None:
+            self.local.sock.close()
+            self.local.sock = None
+
+    def encode(self, sentences: List[str], **kwargs) -> np.ndarray:
+        if not sentences:
+            return np.empty((0, 0), dtype=np.float32)
+        sentences = list(sentences)
+        return np.vstack([
+            self.encode_chunk(sentences[start:start + self.chunk_size])
+            for start in range(0, len(sentences), self.chunk_size)
+        ])
+
+    def encode_chunk(self, sentences: List[str]) -> np.ndarray:
+        payload = json.dumps(sentences, ensure_ascii=False).encode("utf-8")
+        try:
+            return self.request(payload)
+        except ConnectionError:
+            # the server may have been restarted, a new connection is tried once.
+            # A timeout is not retried, the server is still busy with the request
+            return self.request(payload)
+
+    def request(self, payload: bytes) -> np.ndarray:
+        sock = self.connection()
+        try:
+            sock.sendall(REQUEST_HEADER.pack(len(payload)) + payload)
+            status, rows, dim = RESPONSE_HEADER.unpack(read_exactly(sock, RESPONSE_HEADER.size))
+            if status:
+                raise Exception(f"Embedding server error: {read_exactly(sock, rows).decode('utf-8')}")
+            return np.frombuffer(read_exactly(sock, rows * dim * 4), dtype=np.float32).reshape(rows, dim)
+        except (ConnectionError, socket.timeout):
+            self.close()
+            raise
+
+
+def main():
+    from engine.faq_models.vectorizer import Vectorizer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--batch-window", type=float, default=0.005)
+    parser.add_argument("--max-batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    Vectorizer.load_model(batch_window=args.batch_window, max_batch_size=args.max_batch_size)
+    with EmbeddingServer(args.socket, Vectorizer.model) as server:
+        logging.info("Embedding server for %s listening on %s", Vectorizer.model_name, args.socket)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
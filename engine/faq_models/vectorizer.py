@@ -1,6 +1,6 @@
-from typing import Callable, List
+from typing import Callable, List, Optional
 
-from sentence_transformers import SentenceTransformer
+from engine.config import EMBEDDING_CHUNK_SIZE, ENCODE_BATCH_SIZE
 
 
 class Vectorizer:
@@ -9,8 +9,40 @@ class Vectorizer:
     """
 
     model: Callable[[List[str]], List[List[float]]]
+    model_name: str = 'distiluse-base-multilingual-cased-v2'
 
     @classmethod
-    def load_model(cls) -> None:
-        cls.model = SentenceTransformer('distiluse-base-multilingual-cased-v2')
+    def load_model(cls, batch_window: Optional[float] = None, max_batch_size: int = ENCODE_BATCH_SIZE) -> None:
+        """
+        With `batch_window` (in seconds) concurrent encode calls are collected
+        for up to that time or `max_batch_size` sentences and encoded together
+        """
+        from sentence_transformers import SentenceTransformer
+
+        cls.model = SentenceTransformer(cls.model_name)
+        if batch_window is not None:
+            from engine.faq_models.batcher import BatchingEncoder
+
+            cls.model = BatchingEncoder(cls.model, batch_window, max_batch_size)
+
+    @classmethod
+    def connect(
+            cls,
+            socket_path: str,
+            timeout: Optional[float] = 30,
+            chunk_size: int = EMBEDDING_CHUNK_SIZE,
+    ) -> None:
+        """
+        Encode sentences in a shared embedding server (see engine.faq_models.server)
+        instead of loading the model in this process
+        """
+        from engine.faq_models.server import EmbeddingClient
+
+        cls.model = EmbeddingClient(socket_path, timeout, chunk_size)
+
+    @classmethod
+    def get_model(cls) -> Callable[[List[str]], List[List[float]]]:
+        if not hasattr(cls, "model"):
+            cls.load_model()
+        return cls.model
 
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from engine.core.broadcast import Broadcaster
+
+
+def broadcaster(send, **kwargs):
+    kwargs.setdefault("workers", 4)
+    return Broadcaster(send, rate=10000, chat_rate=10000, report_interval=60, **kwargs)
+
+
+def test_retry_after_requeues_without_spending_an_attempt():
+    calls = {}
+    lock = threading.Lock()
+
+    def send(user_id):
+        with lock:
+            calls[user_id] = calls.get(user_id, 0) + 1
+            count = calls[user_id]
+        if user_id == 3 and count <= 5:
+            raise RetryAfter(0)
+
+    stats = broadcaster(send, max_retries=1).run(range(10))
+    assert (stats.sent, stats.failed, stats.retried) == (10, 0, 5)
+    assert calls[3] == 6
+
+
+def test_failures_are_final_or_retried_up_to_max_retries():
+    calls = {}
+
+    def send(user_id):
+        calls[user_id] = calls.get(user_id, 0) + 1
+        if user_id == 1:
+            raise BadRequest("Chat not found")
+        if user_id == 2:
+            raise TimedOut()
+
+    stats = broadcaster(send, workers=1, max_retries=1).run([1, 2, 3])
+    assert (stats.sent, stats.failed) == (1, 2)
+    assert calls == {1: 1, 2: 2, 3: 1}
+
+
+def test_checkpoint_resumes_an_interrupted_broadcast(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    sent = []
+
+    def send(user_id):
+        if user_id >= 5 and not resumed:
+            raise BadRequest("interrupted")
+        sent.append(user_id)
+
+    resumed = False
+    first = broadcaster(send, workers=1, checkpoint_path=checkpoint).run(range(5))
+    assert first.sent == 5
+    resumed = True
+    second = broadcaster(send, checkpoint_path=checkpoint).run(range(10))
+    assert (second.skipped, second.sent) == (5, 5)
+    assert sorted(sent) == list(range(10))
+
+
+def test_checkpoint_is_written_as_users_finish(tmp_path):
+    checkpoint = tmp_path / "checkpoint"
+    seen = []
+
+    def send(user_id):
+        # the users finished before this one are already on disk
+        seen.append(checkpoint.read_text().split())
+
+    broadcaster(send, workers=1, checkpoint_path=str(checkpoint)).run(range(3))
+    assert seen == [[], ["0"], ["0", "1"]]
+
+
+def test_interrupted_broadcast_stops_workers_before_closing_the_checkpoint(tmp_path, monkeypatch):
+    checkpoint = tmp_path / "checkpoint"
+    errors = []
+
+    def users():
+        yield from range(20)
+        raise KeyboardInterrupt
+
+    def send(user_id):
+        time.sleep(0.01)
+
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    instance = broadcaster(send, workers=2, checkpoint_path=str(checkpoint))
+    with pytest.raises(KeyboardInterrupt):
+        instance.run(users())
+    time.sleep(0.1)
+    assert errors == []
+    written = checkpoint.read_text().split()
+    assert len(written) == len(set(written)) == instance.stats.sent
@@ -0,0 +1,19 @@
+import json
+
+from engine.core.content import Keyboard
+
+
+def test_layouts_are_interned_and_serialized_once():
+    keyboard = Keyboard([["yes", "no"]])
+    assert Keyboard([["yes", "no"]]) is keyboard
+    assert Keyboard([["yes", "no"]], inline_mode=True) is not keyboard
+    assert json.loads(keyboard.markup)["keyboard"] == [[{"text": "yes"}, {"text": "no"}]]
+
+
+def test_intern_table_is_bounded_and_keeps_registered_keyboards(monkeypatch):
+    monkeypatch.setattr(Keyboard, "max_interned", 3)
+    menu = Keyboard.register("test_menu", [["menu"]])
+    for page in range(10):
+        Keyboard([[{"text": "next", "callback_data": f"page {page}"}]], inline_mode=True)
+    assert len(Keyboard.interned) <= 3
+    assert Keyboard.get("test_menu") is menu
@@ -0,0 +1,136 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from engine.core.context_store import AppendLogContextStore, FileContextStore, SqliteContextStore
+
+STORES = {
+    "file": lambda path, serializer: FileContextStore(str(path / "contexts"), serializer),
+    "sqlite": lambda path, serializer: SqliteContextStore(str(path / "contexts.sqlite3"), serializer),
+    "append_log": lambda path, serializer: AppendLogContextStore(str(path / "contexts.log"), serializer),
+}
+
+
+@pytest.mark.parametrize("serializer", ["json", "binary"])
+@pytest.mark.parametrize("kind", list(STORES))
+def test_round_trip(tmp_path, kind, serializer):
+    store = STORES[kind](tmp_path, serializer)
+    store.save({"id": 1, "state": "start"})
+    store.save({"id": -2, "state": "menu", "items": [1, 2]})
+    assert store.load(1) == {"id": 1, "state": "start"}
+    store.flush()
+    store.save({"id": 1, "state": "paid"})
+    store.close()
+
+    reopened = STORES[kind](tmp_path, serializer)
+    assert reopened.load(1) == {"id": 1, "state": "paid"}
+    assert reopened.load(-2) == {"id": -2, "state": "menu", "items": [1, 2]}
+    assert reopened.load(3) is None
+    assert sorted(reopened.user_ids()) == [-2, 1]
+    reopened.close()
+
+
+def test_append_log_drops_record_cut_by_crash(tmp_path):
+    store = STORES["append_log"](tmp_path, "json")
+    store.save({"id": 1, "state": "first"})
+    store.flush()
+    store.save({"id": 2, "state": "second"})
+    store.flush()
+    size = store.path.stat().st_size
+    store.file.close()
+    # the last record is cut in the middle, like a write interrupted by a crash
+    with open(store.path, "r+b") as file:
+        file.truncate(size - 5)
+
+    reopened = STORES["append_log"](tmp_path, "json")
+    assert reopened.load(1) == {"id": 1, "state": "first"}
+    assert reopened.load(2) is None
+    reopened.save({"id": 2, "state": "again"})
+    reopened.close()
+    assert STORES["append_log"](tmp_path, "json").load(2) == {"id": 2, "state": "again"}
+
+
+def test_append_log_compacts_outdated_records(tmp_path):
+    store = STORES["append_log"](tmp_path, "json")
+    for number in range(20):
+        store.save({"id": 1, "state": str(number)})
+        store.flush()
+    store.close()
+    size = store.path.stat().st_size
+
+    reopened = STORES["append_log"](tmp_path, "json")
+    assert reopened.path.stat().st_size < size
+    assert reopened.load(1) == {"id": 1, "state": "19"}
+    reopened.close()
+
+
+def test_sqlite_keeps_flushed_contexts_without_close(tmp_path):
+    store = STORES["sqlite"](tmp_path, "json")
+    store.save({"id": 1, "state": "flushed"})
+    store.flush()
+    store.save({"id": 2, "state": "not flushed"})
+
+    # a second connection sees what a process that died after the flush had committed
+    reopened = STORES["sqlite"](tmp_path, "json")
+    assert reopened.load(1) == {"id": 1, "state": "flushed"}
+    assert reopened.load(2) is None
+    reopened.close()
+    store.close()
+
+
+def test_load_sees_contexts_while_they_are_written(tmp_path):
+    class SlowStore(FileContextStore):
+        def write(self, records):
+            time.sleep(0.2)
+            super().write(records)
+
+    store = SlowStore(str(tmp_path))
+    store.save({"id": 1, "state": "old"})
+    store.flush()
+    store.save({"id": 1, "state": "new"})
+    flush = threading.Thread(target=store.flush)
+    flush.start()
+    time.sleep(0.05)
+    assert store.load(1)["state"] == "new"
+    flush.join()
+    assert store.load(1)["state"] == "new"
+    assert not store.flushing
+
+
+def test_a_context_that_can_not_be_serialized_does_not_lose_the_batch(tmp_path):
+    store = FileContextStore(str(tmp_path))
+    broken = {"id": 2, "payload": {"at": datetime.now()}}
+    for context in ({"id": 1, "state": "a"}, broken, {"id": 3, "state": "c"}):
+        store.save(context)
+    store.flush()
+
+    reopened = FileContextStore(str(tmp_path))
+    assert reopened.load(1) == {"id": 1, "state": "a"}
+    assert reopened.load(3) == {"id": 3, "state": "c"}
+    assert store.dirty == {2: broken}
+    assert not store.flushing
+
+    broken["payload"] = {"at": "today"}
+    store.flush()
+    assert FileContextStore(str(tmp_path)).load(2) == {"id": 2, "payload": {"at": "today"}}
+
+
+def test_a_failed_write_is_retried_by_the_next_flush(tmp_path):
+    class FailingStore(FileContextStore):
+        fail = True
+
+        def write(self, records):
+            if self.fail:
+                raise OSError("disk full")
+            super().write(records)
+
+    store = FailingStore(str(tmp_path))
+    store.save({"id": 1, "state": "a"})
+    with pytest.raises(OSError):
+        store.flush()
+    assert store.load(1) == {"id": 1, "state": "a"}
+    store.fail = False
+    store.flush()
+    assert FileContextStore(str(tmp_path)).load(1) == {"id": 1, "state": "a"}
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from engine.faq_models.server import EmbeddingClient, EmbeddingServer
+
+
+class CountingModel:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+
+    def encode(self, sentences):
+        self.batches.append(len(sentences))
+        time.sleep(self.delay)
+        return np.array([[len(sentence), 1.0] for sentence in sentences], dtype=np.float32)
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def start(model):
+        server = EmbeddingServer(str(tmp_path / f"embeddings{len(servers)}.sock"), model)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_large_inputs_are_sent_in_chunks(serve):
+    model = CountingModel()
+    client = EmbeddingClient(serve(model), chunk_size=100)
+    sentences = ["x" * (number % 7) for number in range(250)]
+    vectors = client.encode(sentences)
+    assert model.batches == [100, 100, 50]
+    assert vectors[:, 0].tolist() == [len(sentence) for sentence in sentences]
+
+
+def test_a_timeout_is_not_retried(serve):
+    model = CountingModel(delay=0.3)
+    client = EmbeddingClient(serve(model), timeout=0.1)
+    with pytest.raises(OSError):
+        client.encode(["slow"])
+    time.sleep(0.3)
+    assert model.batches == [1]
+    # the connection left by the timeout is replaced by a new one
+    model.delay = 0
+    assert client.encode(["ok"]).tolist() == [[2.0, 1.0]]
@@ -0,0 +1,44 @@
+import time
+
+from engine.core.faq_cache import FaqResultCache
+
+
+def test_keys_ignore_case_and_spacing():
+    assert FaqResultCache.key("  Как   ОПЛАТИТЬ ", "v1", 0.5, None) == FaqResultCache.key("как оплатить", "v1", 0.5, None)
+    assert FaqResultCache.key("как оплатить", "v1", 0.5, None) != FaqResultCache.key("как оплатить", "v2", 0.5, None)
+    assert FaqResultCache.key("как оплатить", "v1", 0.5, None) != FaqResultCache.key("как оплатить", "v1", 0.6, None)
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = FaqResultCache(2)
+    cache.put(("a", "v"), 1)
+    cache.put(("b", "v"), 2)
+    assert cache.get(("a", "v")) == 1
+    cache.put(("c", "v"), 3)
+    assert cache.get(("b", "v")) is None
+    assert cache.get(("a", "v")) == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_results_expire_after_ttl():
+    cache = FaqResultCache(10, ttl=0.05)
+    cache.put(("a", "v"), 1)
+    time.sleep(0.1)
+    assert cache.get(("a", "v")) is None
+    assert len(cache) == 0
+
+
+def test_invalidate_drops_one_version():
+    cache = FaqResultCache(10)
+    cache.put(("a", "v1"), 1)
+    cache.put(("a", "v2"), 2)
+    cache.invalidate("v1")
+    assert cache.get(("a", "v1")) is None
+    assert cache.get(("a", "v2")) == 2
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_zero_size_disables_the_cache():
+    cache = FaqResultCache(0)
+    cache.put(("a", "v"), 1)
+    assert cache.get(("a", "v")) is None
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from engine.faq_models.index import FaqIndex, normalize
+
+
+def synthetic_faq(rng, intents: int = 40, dim: int = 32):
+    counts = rng.integers(1, 6, size=intents)
+    vectors = rng.normal(size=(int(counts.sum()), dim)).astype(np.float32)
+    faq_dict, start = {}, 0
+    for number, count in enumerate(counts):
+        faq_dict[f"intent_{number}"] = {
+            "phrases": [f"phrase {number} {j}" for j in range(count)],
+            "answer": f"answer {number}",
+            "metadata": {"number": number},
+            "vectors": vectors[start:start + count],
+        }
+        start += count
+    return faq_dict, vectors
+
+
+def cosine_ranking(faq_dict, message_vector, similarity_score):
+    """FAQ matching as UniFilter did it before the index, one cosine_similarity per intent"""
+    options = []
+    for key in faq_dict.keys():
+        max_score = np.max(cosine_similarity(message_vector, faq_dict[key]["vectors"]))
+        if max_score > similarity_score:
+            options.append((key, max_score))
+    options.sort(key=lambda option: option[1], reverse=True)
+    return options
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_search_matches_the_cosine_similarity_ranking(seed):
+    rng = np.random.default_rng(seed)
+    faq_dict, vectors = synthetic_faq(rng)
+    index = FaqIndex(faq_dict, normalize(vectors))
+    for _ in range(20):
+        message_vector = rng.normal(size=(1, vectors.shape[1]))
+        expected = cosine_ranking(faq_dict, message_vector, 0.1)
+        found = index.search(message_vector, 0.1)
+        assert [key for key, _, _ in found] == [key for key, _ in expected]
+        assert [score for _, _, score in found] == pytest.approx([score for _, score in expected], abs=1e-5)
+        for key, option, _ in found:
+            assert option == {
+                "phrases": faq_dict[key]["phrases"],
+                "answer": faq_dict[key]["answer"],
+                "metadata": faq_dict[key]["metadata"],
+            }
+
+
+def test_intents_without_phrases_are_never_matched():
+    faq_dict = {
+        "empty": {"phrases": [], "answer": "", "metadata": {}},
+        "hello": {"phrases": ["hello"], "answer": "hi", "metadata": {}},
+    }
+    index = FaqIndex(faq_dict, normalize([[1.0, 0.0]]))
+    assert [key for key, _, _ in index.search([[1.0, 0.1]], 0.5)] == ["hello"]
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 2e-3), ("int8", 2e-2)])
+def test_compact_dtypes_score_within_tolerance(dtype, tolerance):
+    rng = np.random.default_rng(0)
+    faq_dict, vectors = synthetic_faq(rng, intents=200)
+    exact = FaqIndex(faq_dict, normalize(vectors))
+    compact = FaqIndex(faq_dict, normalize(vectors), dtype=dtype)
+    assert compact.matrix.dtype == np.dtype(dtype)
+    for _ in range(20):
+        message_vector = rng.normal(size=(1, vectors.shape[1]))
+        assert compact.scores(message_vector) == pytest.approx(exact.scores(message_vector), abs=tolerance)
+        best, _ = exact.top_k(message_vector, 1)
+        scores = exact.scores(message_vector)
+        # the best intent is kept unless another one is within the tolerance
+        if np.sort(scores)[-2] < scores[best[0]] - 2 * tolerance:
+            assert compact.top_k(message_vector, 1)[0][0] == best[0]
+
+
+def test_unknown_dtype_is_refused():
+    with pytest.raises(Exception):
+        FaqIndex({"a": {"phrases": ["a"], "answer": "", "metadata": {}}}, normalize([[1.0]]), dtype="float64")
+
+
+def test_exact_backend_finds_k_intents_when_one_intent_owns_most_phrases():
+    from engine.faq_models.search import ExactSearch
+
+    rng = np.random.default_rng(0)
+    query = normalize(rng.normal(size=16))
+    big = normalize(query + 0.01 * rng.normal(size=(300, 16)))
+    small = normalize(query + 0.5 * rng.normal(size=(9, 16)))
+    faq_dict = {"big": {"phrases": [f"big {i}" for i in range(300)], "answer": "", "metadata": {}}}
+    faq_dict.update({f"small {i}": {"phrases": [f"small {i}"], "answer": "", "metadata": {}} for i in range(9)})
+    matrix = np.vstack([big, small])
+
+    expected = FaqIndex(faq_dict, matrix).top_k(query, 3)
+    found = FaqIndex(faq_dict, matrix, ExactSearch()).top_k(query, 3)
+    assert found[0].tolist() == expected[0].tolist()
+    assert found[1] == pytest.approx(expected[1], abs=1e-5)
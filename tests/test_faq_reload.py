@@ -0,0 +1,129 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+from telegram import Update
+
+from engine import TelegramBot
+from engine.core.context_store import FileContextStore
+from engine.core.handler import UniHandler
+from engine.core.media_cache import MediaCache
+from engine.core.user_registry import UserRegistry
+from engine.faq_models.vectorizer import Vectorizer
+
+
+class WordEncoder:
+    """Bag of words over a fixed vocabulary, `hold` blocks the encoding of one sentence"""
+
+    words = ["how", "to", "pay", "card", "refund", "money", "back", "schedule"]
+
+    def __init__(self):
+        self.encoded = []
+        self.hold = None
+        self.holding = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self, sentences, **kwargs):
+        self.encoded.extend(sentences)
+        if self.hold in sentences:
+            self.holding.set()
+            self.release.wait(5)
+        return np.array([
+            [sentence.split().count(word) for word in self.words] for sentence in sentences
+        ], dtype=np.float32)
+
+
+@pytest.fixture
+def faq_bot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # handlers of other tests are registered on the class
+    monkeypatch.setattr(UniHandler, "handler_storage", [])
+    encoder = WordEncoder()
+    monkeypatch.setattr(Vectorizer, "model", encoder, raising=False)
+    monkeypatch.setattr(Vectorizer, "model_name", "test-words")
+    faq = {
+        "pay": {"phrases": ["how to pay", "pay card"], "answer": "A1", "metadata": {}},
+        "schedule": {"phrases": ["schedule"], "answer": "S", "metadata": {}},
+    }
+    with open("faq.json", "w", encoding="utf-8") as file:
+        json.dump(faq, file)
+    bot = TelegramBot(
+        token="123456:test",
+        use_context=True,
+        bot_name="faq_reload_test",
+        context_store=FileContextStore(str(tmp_path / "contexts")),
+        user_registry=UserRegistry(str(tmp_path / "users.sqlite3")),
+        media_cache=MediaCache(str(tmp_path / "media.json")),
+        send_workers=0,
+    )
+    answers = []
+
+    @bot.bot_handler(faq_json_path="faq.json", similarity_score=0.5)
+    def answer(update, context):
+        answers.append(update["handler_payload"]["faq_answer"][0][1]["answer"])
+
+    bot.add_handlers()
+    yield bot, faq, encoder, answers
+    bot.stop()
+
+
+def update(bot, update_id, text):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "user"}, "text": text,
+    }}, bot.bot)
+
+
+def rewrite(faq):
+    with open("faq.json", "w", encoding="utf-8") as file:
+        json.dump(faq, file)
+
+
+def test_reload_swaps_the_index_and_invalidates_cached_results(faq_bot):
+    bot, faq, encoder, answers = faq_bot
+    bot.process_update(update(bot, 1, "how to pay"))
+    bot.process_update(update(bot, 2, "How  to pay"))
+    assert answers == ["A1", "A1"]
+    assert bot.faq_cache.stats()["hits"] == 1
+
+    assert bot.reload_faq() == 0
+    faq["pay"]["answer"] = "A2"
+    faq["refund"] = {"phrases": ["refund money back"], "answer": "R", "metadata": {}}
+    rewrite(faq)
+    encoder.encoded.clear()
+    assert bot.reload_faq() == 1
+    # only the new phrase is encoded again
+    assert encoder.encoded == ["refund money back"]
+    assert len(bot.faq_cache) == 0
+
+    bot.process_update(update(bot, 3, "how to pay"))
+    bot.process_update(update(bot, 4, "refund money back"))
+    assert answers[2:] == ["A2", "R"]
+
+
+def test_a_search_in_progress_keeps_the_index_it_started_with(faq_bot):
+    bot, faq, encoder, answers = faq_bot
+    encoder.hold = "pay card"
+    in_flight = threading.Thread(target=bot.process_update, args=(update(bot, 1, "pay card"),))
+    in_flight.start()
+    assert encoder.holding.wait(5)
+
+    faq["pay"]["answer"] = "A2"
+    rewrite(faq)
+    # the reload does not wait for the update that is being handled
+    assert bot.reload_faq() == 1
+    encoder.release.set()
+    in_flight.join(5)
+    bot.process_update(update(bot, 2, "pay card"))
+    assert answers == ["A1", "A2"]
+
+
+def test_a_broken_file_keeps_the_current_index(faq_bot):
+    bot, faq, encoder, answers = faq_bot
+    with open("faq.json", "w", encoding="utf-8") as file:
+        file.write("{broken")
+    with pytest.raises(ValueError):
+        bot.reload_faq()
+    bot.process_update(update(bot, 1, "how to pay"))
+    assert answers == ["A1"]
@@ -0,0 +1,40 @@
+import random
+
+from engine.core.matcher import PhraseMatcher
+
+
+def test_scan_finds_the_same_owners_as_substring_search():
+    rng = random.Random(0)
+    alphabet = "abcа б"
+    phrases = {
+        owner: ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(3)]
+        for owner in range(40)
+    }
+    matcher = PhraseMatcher()
+    for owner, owner_phrases in phrases.items():
+        matcher.add(owner, owner_phrases)
+
+    for _ in range(500):
+        message = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        expected = {
+            owner for owner, owner_phrases in phrases.items()
+            if any(phrase in message for phrase in owner_phrases)
+        }
+        assert matcher.scan(message) == expected
+
+
+def test_phrases_added_after_a_scan_are_found():
+    matcher = PhraseMatcher()
+    matcher.add("first", ["hello"])
+    assert matcher.scan("hello world") == {"first"}
+    matcher.add("second", ["world"])
+    assert matcher.scan("hello world") == {"first", "second"}
+
+
+def test_regex_phrases_are_searched_per_owner():
+    matcher = PhraseMatcher()
+    matcher.add("orders", [r"order \d+", "menu"])
+    assert matcher.scan("order 15") == set()
+    assert matcher.search("orders", "order 15")
+    assert not matcher.search("orders", "order x")
+    assert not matcher.search("other", "order 15")
@@ -0,0 +1,71 @@
+import io
+
+import pytest
+from telegram import Chat, InputFile, InputMediaPhoto, Message, PhotoSize
+from telegram.error import BadRequest
+
+from engine.core.media_cache import MediaCache
+
+
+def message(file_id):
+    return Message(1, None, 0, Chat(1, "private"), photo=[PhotoSize("small", "u", 1, 1), PhotoSize(file_id, "u", 2, 2)])
+
+
+class FakeApi:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.calls.append(photo if isinstance(photo, str) else len(photo.input_file_content))
+        if self.errors:
+            raise self.errors.pop(0)
+        return message(f"id{len(self.calls)}")
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        self.calls.append([item.media if isinstance(item.media, str) else "upload" for item in media])
+        return [message(f"group{len(self.calls)}_{number}") for number in range(len(media))]
+
+
+def test_a_file_is_uploaded_once_and_its_largest_size_is_reused(tmp_path):
+    cache = MediaCache(str(tmp_path / "media.json"))
+    api = FakeApi()
+    photo = io.BytesIO(b"x" * 100)
+    for chat in range(3):
+        cache.send(api.send_photo, "photo", photo, chat_id=chat)
+    assert api.calls == [100, "id1", "id1"]
+    assert MediaCache(str(tmp_path / "media.json")).file_ids == cache.file_ids
+
+
+def test_input_media_of_a_group_is_rewritten_to_file_ids(tmp_path):
+    cache = MediaCache(str(tmp_path / "media.json"))
+    api = FakeApi()
+    media = [InputMediaPhoto(io.BytesIO(b"a" * 10)), InputMediaPhoto(io.BytesIO(b"b" * 10))]
+    cache.send_group(api.send_media_group, media, chat_id=1)
+    cache.send_group(api.send_media_group, media, chat_id=2)
+    assert api.calls == [["upload", "upload"], ["group1_0", "group1_1"]]
+    # the caller's InputMedia keep their files
+    assert all(isinstance(item.media, InputFile) for item in media)
+
+
+def test_recipient_errors_keep_the_file_id(tmp_path):
+    cache = MediaCache(str(tmp_path / "media.json"))
+    api = FakeApi()
+    photo = io.BytesIO(b"x" * 100)
+    cache.send(api.send_photo, "photo", photo, chat_id=1)
+    api.errors = [BadRequest("Chat not found")]
+    with pytest.raises(BadRequest):
+        cache.send(api.send_photo, "photo", photo, chat_id=2)
+    cache.send(api.send_photo, "photo", photo, chat_id=3)
+    assert api.calls == [100, "id1", "id1"]
+
+
+def test_a_rejected_file_id_is_forgotten_and_the_file_uploaded_again(tmp_path):
+    cache = MediaCache(str(tmp_path / "media.json"))
+    api = FakeApi()
+    photo = io.BytesIO(b"x" * 100)
+    cache.send(api.send_photo, "photo", photo, chat_id=1)
+    api.errors = [BadRequest("Wrong file identifier/http url specified")]
+    cache.send(api.send_photo, "photo", photo, chat_id=2)
+    cache.send(api.send_photo, "photo", photo, chat_id=3)
+    assert api.calls == [100, "id1", 100, "id3"]
@@ -0,0 +1,68 @@
+import time
+
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.utils.request import Request
+
+from engine.core.sender import SendQueue
+from fake_bot_api import FakeBotApiServer
+
+
+def test_calls_to_a_chat_are_delivered_in_order():
+    server = FakeBotApiServer(latency=0.002)
+    bot = Bot("123456:test", base_url=server.base_url, request=Request(con_pool_size=8))
+    queue = SendQueue(workers=4)
+    for number in range(20):
+        for chat in range(1, 9):
+            queue.submit(chat, bot.send_message, kwargs={"chat_id": chat, "text": str(number)})
+    queue.join()
+    queue.shutdown()
+    server.shutdown()
+
+    assert queue.stats()["sent"] == 160 and queue.stats()["failed"] == 0
+    assert sorted(server.calls) == [str(chat) for chat in range(1, 9)]
+    for calls in server.calls.values():
+        assert [int(call["text"]) for call in calls] == list(range(20))
+
+
+def test_failed_calls_are_counted_and_do_not_stop_the_chat():
+    queue = SendQueue(workers=1)
+    delivered = []
+
+    def send(text):
+        if text == "bad":
+            raise ValueError("rejected")
+        delivered.append(text)
+
+    for text in ["first", "bad", "last"]:
+        queue.submit(1, send, (text,))
+    queue.join()
+    queue.shutdown()
+    assert delivered == ["first", "last"]
+    assert queue.stats()["failed"] == 1
+
+
+def test_retry_after_does_not_delay_other_chats_of_the_worker():
+    queue = SendQueue(workers=1)
+    delivered = []
+    rejected = []
+
+    def send(chat, text):
+        if text == "limited" and not rejected:
+            rejected.append(text)
+            raise RetryAfter(1)
+        delivered.append((chat, text, time.monotonic()))
+
+    start = time.monotonic()
+    queue.submit(1, send, (1, "limited"))
+    queue.submit(1, send, (1, "after"))
+    for number in range(5):
+        queue.submit(2, send, (2, str(number)))
+    queue.join()
+    queue.shutdown()
+
+    assert [(chat, text) for chat, text, _ in delivered if chat == 1] == [(1, "limited"), (1, "after")]
+    assert [text for chat, text, _ in delivered if chat == 2] == ["0", "1", "2", "3", "4"]
+    assert all(at - start < 0.5 for chat, _, at in delivered if chat == 2)
+    assert all(at - start >= 1 for chat, _, at in delivered if chat == 1)
+    assert queue.stats()["sent"] == 7
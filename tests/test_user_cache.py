@@ -0,0 +1,43 @@
+import time
+
+from engine.core.context_store import FileContextStore
+from engine.core.user_cache import UserDataCache
+
+
+def context(user_id, state):
+    return {user_id: {"id": user_id, "state": state}}
+
+
+def test_evicted_users_are_saved_and_loaded_back(tmp_path):
+    store = FileContextStore(str(tmp_path))
+    cache = UserDataCache(store, max_size=2)
+    cache[1] = context(1, "menu")
+    cache[2] = context(2, "start")
+    cache[1][1]["state"] = "paid"
+    cache[3] = context(3, "start")
+
+    # user 2 was the least recently used
+    assert 2 not in cache and 1 in cache and 3 in cache
+    assert cache.stats()["evictions"] == 1
+    assert cache[2] == context(2, "start")
+    assert 1 not in cache
+
+    store.flush()
+    reopened = UserDataCache(FileContextStore(str(tmp_path)), max_size=2)
+    assert reopened[1] == context(1, "paid")
+    assert reopened.stats()["misses"] == 1
+
+
+def test_idle_users_are_evicted_after_ttl(tmp_path):
+    cache = UserDataCache(FileContextStore(str(tmp_path)), ttl=0.05)
+    cache[1] = context(1, "menu")
+    time.sleep(0.1)
+    cache[2] = context(2, "start")
+    assert 1 not in cache
+    assert cache[1] == context(1, "menu")
+
+
+def test_unknown_users_get_an_empty_context(tmp_path):
+    cache = UserDataCache(FileContextStore(str(tmp_path)), max_size=10)
+    assert cache[5] == {}
+    assert cache.get(6) is None
@@ -0,0 +1,43 @@
+import time
+
+from engine.core.context_store import FileContextStore
+from engine.core.user_registry import UserRegistry
+
+
+def test_iter_ids_streams_segments_in_chunks(tmp_path):
+    registry = UserRegistry(str(tmp_path / "users.sqlite3"))
+    for user_id in range(1, 51):
+        registry.touch({"id": user_id, "state": "paid" if user_id % 5 == 0 else "free"})
+    registry.flush()
+    before = time.time()
+    time.sleep(0.01)
+    registry.touch({"id": 7, "state": "paid"})
+
+    assert list(registry.iter_ids(chunk_size=7)) == list(range(1, 51))
+    assert list(registry.iter_ids(state="paid", chunk_size=3)) == [5, 7, 10, 15, 20, 25, 30, 35, 40, 45, 50]
+    assert list(registry.iter_ids(state=["paid", "free"], seen_after=before)) == [7]
+    assert registry.count(seen_before=before) == 49
+    assert registry.count(state="missing") == 0
+    registry.close()
+
+
+def test_state_is_written_as_the_callback_left_it(tmp_path):
+    registry = UserRegistry(str(tmp_path / "users.sqlite3"))
+    context = {"id": 1, "state": "start"}
+    registry.touch(context)
+    context["state"] = "menu"
+    assert list(registry.iter_ids(state="menu")) == [1]
+    registry.close()
+    assert list(UserRegistry(str(tmp_path / "users.sqlite3")).iter_ids(state="menu")) == [1]
+
+
+def test_migrate_registers_the_users_of_a_context_store_once(tmp_path):
+    store = FileContextStore(str(tmp_path / "contexts"))
+    for user_id in range(1, 6):
+        store.save({"id": user_id, "state": "old"})
+    store.flush()
+    registry = UserRegistry(str(tmp_path / "users.sqlite3"))
+    assert registry.migrate(store) == 5
+    assert registry.migrate(store) == 0
+    assert list(registry.iter_ids(state="old")) == [1, 2, 3, 4, 5]
+    registry.close()
@@ -0,0 +1,80 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from engine.core.executor import ShardedExecutor
+from engine.core.webhook import WebhookServer
+
+
+class BlockedBot:
+    """Bot with one update worker that handles nothing until `release` is set"""
+
+    bot = None
+
+    def __init__(self):
+        self.update_executor = ShardedExecutor(1, queue_size=1, name="TestUpdates")
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.handled = []
+
+    def run_update(self, update):
+        self.started.set()
+        self.release.wait(5)
+        self.handled.append(update.update_id)
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers
+
+
+def update(update_id):
+    return json.dumps({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0,
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "user"},
+        "text": "hi",
+    }}).encode("utf-8")
+
+
+@pytest.fixture
+def server():
+    bot = BlockedBot()
+    server = WebhookServer(bot, "127.0.0.1", 0, "webhook", overflow="shed")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    bot.release.set()
+    server.shutdown()
+    server.server_close()
+    bot.update_executor.shutdown()
+
+
+def test_full_queue_sheds_with_429(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+    assert post(url, update(1))[0] == 200
+    assert server.bot.started.wait(5)
+    assert post(url, update(2))[0] == 200
+    status, headers = post(url, update(3))
+    assert status == 429
+    assert headers["Retry-After"] == "1"
+    assert server.stats()["accepted"] == 2 and server.stats()["refused"] == 1
+
+    server.bot.release.set()
+    server.bot.update_executor.join()
+    assert server.bot.handled == [1, 2]
+    assert post(url, update(3))[0] == 200
+
+
+@pytest.mark.parametrize("body", [b"{bad", b"null", b'{"foo": 1}', b'{"update_id": 1, "message": 5}'])
+def test_bodies_that_are_not_updates_get_400(server, body):
+    assert post(f"http://127.0.0.1:{server.server_address[1]}/webhook", body)[0] == 400
+
+
+def test_unknown_path_gets_404(server):
+    assert post(f"http://127.0.0.1:{server.server_address[1]}/other", update(1))[0] == 404